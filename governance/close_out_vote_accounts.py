@@ -26,6 +26,12 @@ from algofipy.governance.v1.governance_config import (
 )
 from algofipy.governance.v1.user_voting_escrow_state import UserVotingEscrowState
 
+from governor_state import GovernorStateStore
+from suggested_params import CachedParamsAlgod, DEFAULT_MAX_AGE
+from keeper_submitter import KeeperSubmitter, DEFAULT_MAX_IN_FLIGHT
+from keeper_packer import KeeperPacker, MAX_GROUP_SIZE
+from keeper_dry_run import DryRun
+
 
 def close_out_of_proposal(
     client, user_sending, storage_address_closing_out, proposal_app_id
@@ -58,41 +64,49 @@ if __name__ == "__main__":
         "--indexer_uri", type=str, default="https://algoindexer.algoexplorerapi.io"
     )
     parser.add_argument("--indexer_token", type=str, default="")
-    parser.add_argument("--env_fpath", type=str, required=True)
+    parser.add_argument("--env_fpath", type=str, default="")
+    parser.add_argument("--params_max_age", type=float, default=DEFAULT_MAX_AGE)
+    parser.add_argument("--max_in_flight", type=int, default=DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument("--max_group_size", type=int, default=MAX_GROUP_SIZE)
+    parser.add_argument("--governor_state_fpath", type=str, default="")
+    parser.add_argument("--dry_run_fixtures", type=str, default="")
+    parser.add_argument("--record_fixtures", action="store_true")
     args = parser.parse_args()
+    if not args.env_fpath and not args.dry_run_fixtures:
+        parser.error("--env_fpath is required unless dry running")
+    if not 1 <= args.max_group_size <= MAX_GROUP_SIZE:
+        parser.error("--max_group_size must be between 1 and %d" % MAX_GROUP_SIZE)
+
+    dry_run = DryRun(args.dry_run_fixtures, args.record_fixtures)
+    dry_run.start_phase("setup")
 
-    env_vars = dotenv_values(args.env_fpath)
-    keeper_key = mnemonic.to_private_key(env_vars["mnemonic"])
+    if args.env_fpath:
+        env_vars = dotenv_values(args.env_fpath)
+        keeper_key = mnemonic.to_private_key(env_vars["mnemonic"])
+    else:
+        # dry runs sign with a throwaway key
+        keeper_key, _ = account.generate_account()
     keeper = account.address_from_private_key(keeper_key)
 
-    algod_client = AlgodClient(args.algod_token, args.algod_uri)
-    indexer_client = IndexerClient(args.indexer_token, args.indexer_uri)
+    algod_client, indexer_client = dry_run.wrap(
+        AlgodClient(args.algod_token, args.algod_uri),
+        IndexerClient(args.indexer_token, args.indexer_uri),
+    )
+    # builders share suggested params for --params_max_age seconds
+    algod_client = CachedParamsAlgod(algod_client, args.params_max_age)
     client = AlgofiClient(Network.MAINNET, algod_client, indexer_client)
+    submitter = KeeperSubmitter(client.algod, keeper_key, args.max_in_flight, dry_run)
+    packer = KeeperPacker(submitter, args.max_group_size)
 
     # query governance users
+    dry_run.start_phase("governor state")
     print("Querying governance users...")
-    (
-        governor_admin_state,
-        storage_mapping,
-    ) = client.governance.get_governor_admin_state()
-    governor_voting_escrow_state = client.governance.get_governor_voting_escrow_state()
-    governor_addresses = list(
-        set(
-            list(governor_admin_state.keys())
-            + list(governor_voting_escrow_state.keys())
-        )
-    )
-    governor_state = {}
-    for governor_address in governor_addresses:
-        admin_state = governor_admin_state.get(governor_address, {})
-        voting_escrow_state = governor_voting_escrow_state.get(governor_address, {})
-        if admin_state and voting_escrow_state:
-            governor_state[governor_address] = {
-                "admin": admin_state,
-                "voting_escrow": voting_escrow_state,
-            }
+    governor_state, storage_mapping = GovernorStateStore(
+        client, args.governor_state_fpath
+    ).load()
 
     # query proposals
+    dry_run.start_phase("close outs")
     print("Querying proposals...")
     proposals = client.governance.admin.proposals
     for proposal_app_id in proposals:
@@ -123,5 +137,15 @@ if __name__ == "__main__":
                     txn = close_out_of_proposal(
                         client, keeper, voter_storage_address, proposal_app_id
                     )
-                    txn.sign_with_private_key(keeper_key)
-                    txn.submit(client.algod, wait=False)
+                    packer.add(
+                        txn,
+                        "close out of %s from %d"
+                        % (voter_storage_address, proposal_app_id),
+                    )
+
+    # wait for every close out to land
+    dry_run.start_phase("submit")
+    packer.close()
+    submitter.close()
+    submitter.print_summary()
+    dry_run.close()
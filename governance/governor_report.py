@@ -30,6 +30,9 @@ from algofipy.transaction_utils import (
 from algofipy.governance.v1.governance_config import ADMIN_STRINGS
 from algofipy.governance.v1.user_voting_escrow_state import UserVotingEscrowState
 
+from governor_state import GovernorStateStore
+from vebank_projection import project_vebank, check_array_projection
+
 
 def get_time(tz="EST"):
     tz = timezone(tz)
@@ -50,6 +53,9 @@ if __name__ == "__main__":
     parser.add_argument("--indexer_token", type=str, default="")
     parser.add_argument("--csv_fpath", type=str)
     parser.add_argument("--html_fpath", type=str)
+    parser.add_argument("--governor_state_fpath", type=str, default="")
+    parser.add_argument("--array_vebank_projection", action="store_true")
+    parser.add_argument("--check_vebank_projection", action="store_true")
     args = parser.parse_args()
 
     algod_client = AlgodClient(args.algod_token, args.algod_uri)
@@ -59,33 +65,29 @@ if __name__ == "__main__":
     timestamp = get_time()
 
     # query governance users
-    (
-        governor_admin_state,
-        storage_mapping,
-    ) = client.governance.get_governor_admin_state()
-    governor_voting_escrow_state = client.governance.get_governor_voting_escrow_state()
-    governor_addresses = list(
-        set(
-            list(governor_admin_state.keys())
-            + list(governor_voting_escrow_state.keys())
+    governor_state, storage_mapping = GovernorStateStore(
+        client, args.governor_state_fpath
+    ).load()
+
+    if args.check_vebank_projection:
+        mismatched, sdk_seconds, array_seconds = check_array_projection(
+            client, governor_state
         )
-    )
-    governor_state = {}
-    for governor_address in governor_addresses:
-        admin_state = governor_admin_state.get(governor_address, {})
-        voting_escrow_state = governor_voting_escrow_state.get(governor_address, {})
-        if admin_state and voting_escrow_state:
-            governor_state[governor_address] = {
-                "admin": admin_state,
-                "voting_escrow": voting_escrow_state,
-            }
+        print(
+            "%d of %d governors mismatched, sdk %.3fs, arrays %.3fs"
+            % (len(mismatched), len(governor_state), sdk_seconds, array_seconds)
+        )
+        for governor_address in mismatched:
+            print(governor_address)
+        sys.exit(1 if mismatched else 0)
 
     # iterate over governors, get delegating_to and generate data
     governor_data = {}
+    projected_vebank_amounts = project_vebank(
+        client, governor_state, args.array_vebank_projection
+    )
     for governor_address in governor_state:
-        amount_vebank = client.governance.voting_escrow.get_projected_vebank_amount(
-            UserVotingEscrowState(governor_state[governor_address]["voting_escrow"])
-        )
+        amount_vebank = projected_vebank_amounts[governor_address]
         delegating_to = governor_state[governor_address]["admin"]["delegating_to"]
         governor_storage_address = governor_state[governor_address]["admin"][
             "storage_account"
@@ -0,0 +1,126 @@
+# basic imports
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def join_governor_state(governor_admin_state, governor_voting_escrow_state):
+    """Joins the admin and voting escrow states of every governor which has
+    both, in a single pass over the admin state
+
+    :return: dict of governor address to {"admin": ..., "voting_escrow": ...}
+    :rtype: dict
+    """
+    governor_state = {}
+    for governor_address, admin_state in governor_admin_state.items():
+        voting_escrow_state = governor_voting_escrow_state.get(governor_address, {})
+        if admin_state and voting_escrow_state:
+            governor_state[governor_address] = {
+                "admin": admin_state,
+                "voting_escrow": voting_escrow_state,
+            }
+    return governor_state
+
+
+class GovernorStateStore:
+    """Loads the admin and voting escrow states of all governors in parallel
+    and keeps a snapshot of them stamped with the indexer round it was read
+    at. A later load only refetches a source whose app has transactions after
+    that round, so runs between governance activity share one fetch. The sdk
+    reads each source as a whole, so a touched source is refetched in full.
+    """
+
+    def __init__(self, client, fpath=""):
+        self.client = client
+        self.fpath = fpath
+        self.app_ids = {
+            "admin": client.governance.governance_config.admin_app_id,
+            "voting_escrow": client.governance.voting_escrow.app_id,
+        }
+
+    def fetch_admin_state(self):
+        (
+            governor_admin_state,
+            storage_mapping,
+        ) = self.client.governance.get_governor_admin_state()
+        return {
+            "governor_admin_state": governor_admin_state,
+            "storage_mapping": storage_mapping,
+        }
+
+    def fetch_voting_escrow_state(self):
+        return {
+            "governor_voting_escrow_state": (
+                self.client.governance.get_governor_voting_escrow_state()
+            )
+        }
+
+    def is_touched(self, source, round_):
+        # any call to the source app after the snapshot round may change it
+        txns = self.client.indexer.search_transactions(
+            application_id=self.app_ids[source], min_round=round_ + 1, limit=1
+        )
+        return len(txns.get("transactions", [])) > 0
+
+    def load_snapshot(self):
+        if not self.fpath or not os.path.exists(self.fpath):
+            return None
+        with open(self.fpath, "r") as f:
+            return json.load(f)
+
+    def save_snapshot(self, snapshot):
+        if not self.fpath:
+            return
+        tmp_fpath = self.fpath + ".tmp"
+        with open(tmp_fpath, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_fpath, self.fpath)
+
+    def load(self):
+        """Returns the joined governor state and the storage mapping
+
+        :return: (governor_state, storage_mapping)
+        :rtype: tuple
+        """
+        # the indexer answers is_touched, so the snapshot is stamped with the
+        # round it has caught up to, read before fetching so changes during
+        # the fetch count as touched
+        round_ = self.client.indexer.health()["round"]
+        snapshot = self.load_snapshot()
+        fetches = {
+            "admin": self.fetch_admin_state,
+            "voting_escrow": self.fetch_voting_escrow_state,
+        }
+        with ThreadPoolExecutor(max_workers=len(fetches)) as executor:
+            if snapshot is not None:
+                touched = dict(
+                    zip(
+                        fetches,
+                        executor.map(
+                            lambda source: self.is_touched(source, snapshot["round"]),
+                            fetches,
+                        ),
+                    )
+                )
+                fetches = {
+                    source: fetch
+                    for source, fetch in fetches.items()
+                    if touched[source]
+                }
+            else:
+                snapshot = {}
+            futures = [executor.submit(fetch) for fetch in fetches.values()]
+            for future in futures:
+                snapshot.update(future.result())
+        if fetches:
+            snapshot["round"] = round_
+            self.save_snapshot(snapshot)
+        print(
+            "governor state as of round %d, refetched %s"
+            % (snapshot["round"], ", ".join(fetches) or "nothing")
+        )
+        governor_state = join_governor_state(
+            snapshot["governor_admin_state"],
+            snapshot["governor_voting_escrow_state"],
+        )
+        return governor_state, snapshot["storage_mapping"]
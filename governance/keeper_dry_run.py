@@ -0,0 +1,244 @@
+# basic imports
+import base64
+import copy
+import json
+import os
+from contextlib import contextmanager, nullcontext
+from threading import Lock, local
+from time import perf_counter
+
+from prettytable import PrettyTable
+
+# algorand imports
+from algosdk import encoding
+from algosdk.future.transaction import SuggestedParams
+
+SUGGESTED_PARAMS_KEY = "__suggested_params__"
+PHASE_FIELDS = ["calls", "response bytes", "groups", "txns", "sent bytes"]
+
+
+def get_call_key(name, args, kwargs):
+    return json.dumps([name, args, kwargs], sort_keys=True, default=str)
+
+
+def format_call_args(args, kwargs):
+    return "(%s)" % ", ".join(
+        [repr(arg) for arg in args]
+        + ["%s=%r" % (name, value) for name, value in sorted(kwargs.items())]
+    )
+
+
+def to_fixture(response):
+    # suggested params are the only non json response the keepers read
+    if isinstance(response, SuggestedParams):
+        return {SUGGESTED_PARAMS_KEY: vars(response)}
+    return response
+
+
+def from_fixture(value):
+    if isinstance(value, dict) and SUGGESTED_PARAMS_KEY in value:
+        return SuggestedParams(**value[SUGGESTED_PARAMS_KEY])
+    return value
+
+
+class DryRunStats:
+    """Counts node calls, response bytes, sent groups and timings per phase.
+    Work queued in one phase and run later on another thread is counted in the
+    phase it was queued in, see in_phase.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.current = None
+        self.started_at = None
+        self.lock = Lock()
+        self.local = local()
+
+    def start_phase(self, name):
+        self.end_phase()
+        self.phases.setdefault(name, dict.fromkeys(PHASE_FIELDS + ["seconds"], 0))
+        self.current = name
+        self.started_at = perf_counter()
+
+    def end_phase(self):
+        if self.current is not None:
+            self.phases[self.current]["seconds"] += perf_counter() - self.started_at
+        self.current = None
+
+    @contextmanager
+    def in_phase(self, name):
+        # counts on this thread go to name rather than the current phase
+        self.local.phase = name
+        try:
+            yield
+        finally:
+            self.local.phase = None
+
+    def add(self, **counts):
+        name = getattr(self.local, "phase", None) or self.current
+        with self.lock:
+            phase = self.phases.setdefault(
+                name, dict.fromkeys(PHASE_FIELDS + ["seconds"], 0)
+            )
+            for field, count in counts.items():
+                phase[field.replace("_", " ")] += count
+
+    def print_summary(self):
+        table = PrettyTable()
+        table.field_names = ["Phase"] + PHASE_FIELDS + ["Seconds"]
+        for name, phase in self.phases.items():
+            table.add_row(
+                [name]
+                + [phase[field] for field in PHASE_FIELDS]
+                + ["%.3f" % phase["seconds"]]
+            )
+        print(table)
+
+
+class FixtureProxy:
+    """Stands in for an algod or indexer client. When recording, every call is
+    forwarded to the wrapped client and its response saved under the call name
+    and arguments, otherwise calls are answered from the saved responses.
+    """
+
+    def __init__(self, name, fixtures, stats, target=None):
+        self.name = name
+        self.fixtures = fixtures
+        self.stats = stats
+        self.target = target
+        self.lock = Lock()
+
+    def call(self, method, *args, **kwargs):
+        key = get_call_key(self.name + "." + method, args, kwargs)
+        if self.target is not None:
+            response = getattr(self.target, method)(*args, **kwargs)
+            # callers may change the response, e.g. fees on suggested params
+            value = copy.deepcopy(to_fixture(response))
+            with self.lock:
+                self.fixtures[key] = value
+        else:
+            if key not in self.fixtures:
+                raise KeyError(
+                    "no recorded response for %s%s, replay with the same flags "
+                    "as the recording, e.g. --governor_state_fpath, and note "
+                    "calls which depend on the wall clock can differ"
+                    % (self.name + "." + method, format_call_args(args, kwargs))
+                )
+            value = copy.deepcopy(self.fixtures[key])
+            response = from_fixture(value)
+        self.stats.add(calls=1, response_bytes=len(json.dumps(value, default=str)))
+        return response
+
+    def __getattr__(self, method):
+        if method.startswith("__"):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self.call(method, *args, **kwargs)
+
+
+class DryRunAlgod(FixtureProxy):
+    """Fixture backed algod which takes sent groups without broadcasting them.
+    Rounds advance as soon as they are waited on and a sent group confirms in
+    the round after it was sent. Groups are not evaluated, so a group which
+    would fail on chain is counted as confirmed.
+    """
+
+    def __init__(self, name, fixtures, stats, target=None):
+        super().__init__(name, fixtures, stats, target)
+        self.round = None
+        self.sent = {}
+        self.round_lock = Lock()
+
+    def status(self):
+        with self.round_lock:
+            if self.round is None:
+                self.round = self.call("status")["last-round"]
+            return {"last-round": self.round}
+
+    def status_after_block(self, round_):
+        with self.round_lock:
+            self.round = max(self.round or 0, round_ + 1)
+            return {"last-round": self.round}
+
+    def send_transactions(self, signed_transactions):
+        sent_bytes = sum(
+            len(base64.b64decode(encoding.msgpack_encode(stxn)))
+            for stxn in signed_transactions
+        )
+        txid = signed_transactions[0].transaction.get_txid()
+        round_ = self.status()["last-round"]
+        with self.lock:
+            self.sent[txid] = round_
+        self.stats.add(groups=1, txns=len(signed_transactions), sent_bytes=sent_bytes)
+        return txid
+
+    def pending_transaction_info(self, txid):
+        return {"confirmed-round": self.sent[txid] + 1}
+
+
+class DryRun:
+    """Runs a keeper script against recorded node responses instead of
+    mainnet. With record set, the live clients are queried and their responses
+    saved to fpath, otherwise they are replayed from fpath. Either way sent
+    groups never leave the process. A DryRun without fpath is disabled and
+    passes the live clients through.
+    """
+
+    def __init__(self, fpath="", record=False):
+        self.fpath = fpath
+        self.record = record
+        self.stats = DryRunStats()
+        self.fixtures = {}
+        if fpath and not record:
+            with open(fpath, "r") as f:
+                self.fixtures = json.load(f)
+
+    def wrap(self, algod_client, indexer_client):
+        """Returns the algod and indexer clients the script should use
+
+        :return: (algod_client, indexer_client)
+        :rtype: tuple
+        """
+        if not self.fpath:
+            return algod_client, indexer_client
+        return (
+            DryRunAlgod(
+                "algod",
+                self.fixtures,
+                self.stats,
+                algod_client if self.record else None,
+            ),
+            FixtureProxy(
+                "indexer",
+                self.fixtures,
+                self.stats,
+                indexer_client if self.record else None,
+            ),
+        )
+
+    def start_phase(self, name):
+        if self.fpath:
+            self.stats.start_phase(name)
+
+    def current_phase(self):
+        return self.stats.current if self.fpath else None
+
+    def in_phase(self, name):
+        """Counts node calls made on this thread in phase name
+
+        :return: context manager
+        """
+        if not self.fpath or name is None:
+            return nullcontext()
+        return self.stats.in_phase(name)
+
+    def close(self):
+        """Saves recorded fixtures and prints the per phase summary"""
+        if not self.fpath:
+            return
+        self.stats.end_phase()
+        if self.record:
+            tmp_fpath = self.fpath + ".tmp"
+            with open(tmp_fpath, "w") as f:
+                json.dump(self.fixtures, f)
+            os.replace(tmp_fpath, self.fpath)
+        self.stats.print_summary()
@@ -0,0 +1,128 @@
+# basic imports
+from concurrent.futures import Future, wait
+
+# algofi imports
+from algofipy.transaction_utils import TransactionGroup
+
+from keeper_submitter import GroupResult
+
+# protocol limits on atomic groups and app call references
+MAX_GROUP_SIZE = 16
+MAX_ACCOUNTS = 4
+MAX_FOREIGN_APPS = 8
+MAX_FOREIGN_ASSETS = 8
+MAX_REFERENCES = 8
+
+
+def validate_references(txn):
+    accounts = len(getattr(txn, "accounts", None) or [])
+    foreign_apps = len(getattr(txn, "foreign_apps", None) or [])
+    foreign_assets = len(getattr(txn, "foreign_assets", None) or [])
+    if (
+        accounts > MAX_ACCOUNTS
+        or foreign_apps > MAX_FOREIGN_APPS
+        or foreign_assets > MAX_FOREIGN_ASSETS
+        or accounts + foreign_apps + foreign_assets > MAX_REFERENCES
+    ):
+        raise ValueError(
+            "app call references %d accounts, %d apps and %d assets"
+            % (accounts, foreign_apps, foreign_assets)
+        )
+
+
+class PackedUnit:
+    def __init__(self, transactions, label):
+        self.transactions = transactions
+        self.label = label
+        self.future = Future()
+
+
+class KeeperPacker:
+    """Packs independent keeper updates into atomic groups of up to
+    max_group_size transactions, sent through a KeeperSubmitter. The
+    transactions of one update stay together and in order. A packed group fails
+    as a whole, so a failed group is split in halves and resent until the
+    failing updates are isolated. The submitter summary counts updates rather
+    than the groups they were packed in.
+    """
+
+    def __init__(self, submitter, max_group_size=MAX_GROUP_SIZE):
+        if not 1 <= max_group_size <= MAX_GROUP_SIZE:
+            raise ValueError("max_group_size must be between 1 and %d" % MAX_GROUP_SIZE)
+        self.submitter = submitter
+        self.max_group_size = max_group_size
+        self.units = []
+        self.futures = []
+
+    def add(self, group, label=""):
+        """Queues the transactions of an unsigned group as one update. An
+        update which can not be sent, because it is larger than max_group_size
+        or over the reference limits, is skipped.
+
+        :return: future resolving to the GroupResult of the group the update
+            finally landed or failed in, labelled with label
+        :rtype: :class:`Future`
+        """
+        unit = PackedUnit(group.transactions, label)
+        try:
+            if len(group.transactions) > self.max_group_size:
+                raise ValueError("%d transactions" % len(group.transactions))
+            for txn in group.transactions:
+                validate_references(txn)
+        except ValueError as e:
+            print("skipping %s: %s" % (label, e))
+            self.resolve(unit, GroupResult(label, None, "skipped", None, str(e)))
+            return unit.future
+        self.units.append(unit)
+        self.futures.append(unit.future)
+        return unit.future
+
+    def pack(self, units):
+        # fill groups in order, an update never straddles two groups
+        batches = [[]]
+        size = 0
+        for unit in units:
+            if size + len(unit.transactions) > self.max_group_size:
+                batches.append([])
+                size = 0
+            batches[-1].append(unit)
+            size += len(unit.transactions)
+        return [batch for batch in batches if batch]
+
+    def submit_batch(self, batch, phase):
+        txns = [txn for unit in batch for txn in unit.transactions]
+        # the group id is part of each txid, so it is cleared before regrouping
+        for txn in txns:
+            txn.group = None
+        label = batch[0].label if len(batch) == 1 else "%d updates" % len(batch)
+        # results are recorded per update, not per packed group
+        future = self.submitter.submit(
+            TransactionGroup(txns), label, record=False, phase=phase
+        )
+        future.add_done_callback(lambda f: self.on_result(batch, phase, f.result()))
+
+    def resolve(self, unit, result):
+        self.submitter.record(result)
+        unit.future.set_result(result)
+
+    def on_result(self, batch, phase, result):
+        # resent halves count in the phase which flushed the update
+        if result.status == "failed" and len(batch) > 1:
+            half = len(batch) // 2
+            self.submit_batch(batch[:half], phase)
+            self.submit_batch(batch[half:], phase)
+            return
+        for unit in batch:
+            self.resolve(unit, result._replace(label=unit.label))
+
+    def flush(self):
+        """Packs and submits every queued update"""
+        units, self.units = self.units, []
+        phase = self.submitter.current_phase()
+        for batch in self.pack(units):
+            self.submit_batch(batch, phase)
+
+    def close(self):
+        """Waits for every queued update to land or fail"""
+        self.flush()
+        wait(self.futures)
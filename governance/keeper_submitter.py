@@ -0,0 +1,224 @@
+# basic imports
+from collections import namedtuple, Counter
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from threading import Condition, Thread
+from time import sleep
+
+from keeper_dry_run import DryRun
+
+DEFAULT_MAX_IN_FLIGHT = 8
+
+GroupResult = namedtuple("GroupResult", ["label", "txid", "status", "round", "error"])
+
+
+class PendingGroup:
+    def __init__(self, label, group, future, record=True, phase=None):
+        self.label = label
+        self.group = group
+        self.future = future
+        self.record = record
+        self.phase = phase
+        self.txid = None
+        # the group can not land after the last valid round of its first txn
+        self.last_valid = group.transactions[0].last_valid_round
+
+
+class KeeperSubmitter:
+    """Signs keeper groups, sends them with at most max_in_flight sends at
+    once and tracks the sent groups with a single poller thread, which checks
+    every pending txid once per round. Each submitted group gets a future which
+    resolves to a GroupResult with status confirmed, failed, expired or, for
+    groups chained with submit_after, skipped. Sends run on other threads, so
+    each group carries the dry run phase it was submitted in.
+    """
+
+    def __init__(
+        self, algod, private_key, max_in_flight=DEFAULT_MAX_IN_FLIGHT, dry_run=None
+    ):
+        self.algod = algod
+        self.private_key = private_key
+        self.dry_run = dry_run if dry_run is not None else DryRun()
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.pending = {}
+        self.results = []
+        self.futures = []
+        self.closed = False
+        self.condition = Condition()
+        self.poller = Thread(target=self.poll, daemon=True)
+        self.poller.start()
+
+    def record(self, result):
+        """Adds a result to the summary"""
+        with self.condition:
+            self.results.append(result)
+
+    def resolve(self, entry, status, round_=None, error=None):
+        result = GroupResult(entry.label, entry.txid, status, round_, error)
+        with self.condition:
+            self.pending.pop(entry.txid, None)
+        if entry.record:
+            self.record(result)
+        entry.future.set_result(result)
+
+    def current_phase(self):
+        return self.dry_run.current_phase()
+
+    def send(self, entry):
+        try:
+            with self.dry_run.in_phase(entry.phase):
+                entry.txid = self.algod.send_transactions(
+                    entry.group.signed_transactions
+                )
+        except Exception as e:
+            # rejected by the node, e.g. a failing logic check
+            self.resolve(entry, "failed", error=str(e))
+            return
+        with self.condition:
+            self.pending[entry.txid] = entry
+            self.condition.notify()
+
+    def submit(self, group, label="", record=True, phase=None):
+        """Signs a group and queues it for sending
+
+        :param group: unsigned transaction group
+        :type group: :class:`TransactionGroup`
+        :param label: name of the group in results
+        :type label: str
+        :param record: add the result to the summary, off for groups whose
+            caller records its own results
+        :type record: bool
+        :param phase: dry run phase the send is counted in, defaults to the
+            current one
+        :type phase: str
+        :return: future resolving to a GroupResult
+        :rtype: :class:`Future`
+        """
+        group.sign_with_private_key(self.private_key)
+        if phase is None:
+            phase = self.current_phase()
+        entry = PendingGroup(label, group, Future(), record, phase)
+        self.futures.append(entry.future)
+        self.executor.submit(self.send, entry)
+        return entry.future
+
+    def submit_all(self, groups, labels):
+        return [self.submit(group, label) for group, label in zip(groups, labels)]
+
+    def submit_after(self, dependencies, build_group, label=""):
+        """Submits the group returned by build_group once every dependency
+        future has confirmed. If a dependency failed or expired the group is
+        not built and resolves as skipped.
+
+        :return: future resolving to the GroupResult of the built group
+        :rtype: :class:`Future`
+        """
+        future = Future()
+        remaining = [len(dependencies)]
+        phase = self.current_phase()
+
+        def finish(status, error):
+            result = GroupResult(label, None, status, None, error)
+            self.record(result)
+            future.set_result(result)
+
+        def build_and_submit():
+            # building asks the node for params, so it runs on the executor
+            try:
+                with self.dry_run.in_phase(phase):
+                    group = build_group()
+                submitted = self.submit(group, label, phase=phase)
+            except Exception as e:
+                finish("failed", str(e))
+                return
+            submitted.add_done_callback(lambda f: future.set_result(f.result()))
+
+        def on_done(_):
+            with self.condition:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if not ready:
+                return
+            unconfirmed = [
+                dependency.result()
+                for dependency in dependencies
+                if dependency.result().status != "confirmed"
+            ]
+            if unconfirmed:
+                finish(
+                    "skipped",
+                    "; ".join(
+                        "%s %s" % (result.label, result.status)
+                        for result in unconfirmed
+                    ),
+                )
+                return
+            self.executor.submit(build_and_submit)
+
+        self.futures.append(future)
+        if not dependencies:
+            remaining[0] = 1
+            on_done(None)
+        for dependency in dependencies:
+            dependency.add_done_callback(on_done)
+        return future
+
+    def check(self, entry, round_):
+        try:
+            info = self.algod.pending_transaction_info(entry.txid)
+        except Exception:
+            # dropped from the pool, it can still land until its last round
+            info = {}
+        if info.get("confirmed-round", 0) > 0:
+            self.resolve(entry, "confirmed", round_=info["confirmed-round"])
+        elif info.get("pool-error", ""):
+            self.resolve(entry, "failed", error=info["pool-error"])
+        elif round_ > entry.last_valid:
+            self.resolve(entry, "expired")
+
+    def poll(self):
+        round_ = None
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                pending = list(self.pending.values())
+            try:
+                if round_ is None:
+                    round_ = self.algod.status()["last-round"]
+                for entry in pending:
+                    self.check(entry, round_)
+                # one status call per round, shared by every pending group
+                round_ = self.algod.status_after_block(round_)["last-round"]
+            except Exception as e:
+                print(e)
+                sleep(1)
+
+    def close(self):
+        """Waits for every submitted group to resolve and stops the poller"""
+        # chained groups are submitted from callbacks, so wait before shutdown
+        wait(self.futures)
+        self.executor.shutdown(wait=True)
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.poller.join()
+
+    def print_summary(self):
+        counts = Counter(result.status for result in self.results)
+        print(
+            "%d confirmed, %d failed, %d expired, %d skipped"
+            % (
+                counts["confirmed"],
+                counts["failed"],
+                counts["expired"],
+                counts["skipped"],
+            )
+        )
+        for result in self.results:
+            if result.status != "confirmed":
+                print(
+                    "%s %s: %s %s"
+                    % (result.status, result.label, result.txid, result.error or "")
+                )
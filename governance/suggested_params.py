@@ -0,0 +1,33 @@
+# the liquidation/ and governance/ copies of this module are kept identical
+# basic imports
+import copy
+from threading import Lock
+from time import monotonic
+
+DEFAULT_MAX_AGE = 10
+
+
+class CachedParamsAlgod:
+    """Algod client which reuses suggested params for max_age seconds, so
+    building many groups does not ask the node for params every time. A round
+    takes about 3.5 seconds, so reused params stay well inside their validity
+    window. Every other call goes to the wrapped client.
+    """
+
+    def __init__(self, algod_client, max_age=DEFAULT_MAX_AGE):
+        self.algod_client = algod_client
+        self.max_age = max_age
+        self.params = None
+        self.fetched_at = 0
+        self.lock = Lock()
+
+    def suggested_params(self, **kwargs):
+        with self.lock:
+            if self.params is None or monotonic() - self.fetched_at > self.max_age:
+                self.params = self.algod_client.suggested_params(**kwargs)
+                self.fetched_at = monotonic()
+            # callers set fees on the params they get
+            return copy.deepcopy(self.params)
+
+    def __getattr__(self, name):
+        return getattr(self.algod_client, name)
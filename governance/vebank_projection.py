@@ -0,0 +1,143 @@
+# basic imports
+import time
+import numpy as np
+
+# algofi imports
+from algofipy.governance.v1.governance_config import VOTING_ESCROW_STRINGS
+from algofipy.governance.v1.user_voting_escrow_state import UserVotingEscrowState
+
+# longest BANK lock, veBANK of a lock is assumed to decay linearly to 0 at its
+# end. Neither is read from the sdk, check_array_projection checks them
+MAX_LOCK_TIME = 4 * 365 * 24 * 60 * 60
+RELATIVE_TOLERANCE = 1e-6
+
+
+def get_lock_arrays(voting_escrow_states):
+    # amount locked and lock end time of each voting escrow state
+    amount_locked = np.array(
+        [
+            state.get(VOTING_ESCROW_STRINGS.user_amount_locked, 0)
+            for state in voting_escrow_states
+        ],
+        dtype=np.float64,
+    )
+    lock_end_time = np.array(
+        [
+            state.get(VOTING_ESCROW_STRINGS.user_lock_start_time, 0)
+            + state.get(VOTING_ESCROW_STRINGS.user_lock_duration, 0)
+            for state in voting_escrow_states
+        ],
+        dtype=np.float64,
+    )
+    return amount_locked, lock_end_time
+
+
+def get_projected_vebank_amounts(amount_locked, lock_end_time, timestamp):
+    """Projects the veBANK of every lock at timestamp in one array pass
+
+    :param amount_locked: BANK locked per governor
+    :type amount_locked: :class:`np.ndarray`
+    :param lock_end_time: unix time each lock ends
+    :type lock_end_time: :class:`np.ndarray`
+    :return: projected veBANK per governor
+    :rtype: :class:`np.ndarray`
+    """
+    time_remaining = np.clip(lock_end_time - timestamp, 0, MAX_LOCK_TIME)
+    return amount_locked * time_remaining / MAX_LOCK_TIME
+
+
+def get_sdk_vebank_amounts(client, voting_escrow_states):
+    voting_escrow = client.governance.voting_escrow
+    return [
+        voting_escrow.get_projected_vebank_amount(UserVotingEscrowState(state))
+        for state in voting_escrow_states
+    ]
+
+
+def project_vebank(client, governor_state, use_arrays=False):
+    """Returns the projected veBANK of every governor. The sdk projects each
+    governor by default. With use_arrays, all governors are projected in one
+    array pass instead, which should be validated with check_array_projection
+    against the pinned sdk first.
+
+    :param governor_state: joined governor state, see governor_state.py
+    :type governor_state: dict
+    :param use_arrays: project with get_projected_vebank_amounts
+    :type use_arrays: bool
+    :return: dict of governor address to projected veBANK
+    :rtype: dict
+    """
+    addresses = list(governor_state.keys())
+    voting_escrow_states = [
+        governor_state[address]["voting_escrow"] for address in addresses
+    ]
+    if use_arrays:
+        amount_locked, lock_end_time = get_lock_arrays(voting_escrow_states)
+        projected = get_projected_vebank_amounts(
+            amount_locked, lock_end_time, int(time.time())
+        )
+    else:
+        projected = get_sdk_vebank_amounts(client, voting_escrow_states)
+    return dict(zip(addresses, projected))
+
+
+def check_array_projection(client, governor_state):
+    """Projects every governor through both the sdk and the array pass and
+    returns the governors they disagree on. The sdk reads the clock itself, so
+    its projection must lie between the array projections at timestamps read
+    before and after the sdk calls, give or take a base unit of rounding.
+
+    :param governor_state: joined governor state, see governor_state.py
+    :type governor_state: dict
+    :return: (mismatched addresses, sdk seconds, array seconds)
+    :rtype: tuple
+    """
+    addresses = list(governor_state.keys())
+    voting_escrow_states = [
+        governor_state[address]["voting_escrow"] for address in addresses
+    ]
+    amount_locked, lock_end_time = get_lock_arrays(voting_escrow_states)
+
+    started_at = time.perf_counter()
+    before = int(time.time())
+    expected = np.array(get_sdk_vebank_amounts(client, voting_escrow_states))
+    after = int(time.time())
+    sdk_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    upper = get_projected_vebank_amounts(amount_locked, lock_end_time, before)
+    array_seconds = time.perf_counter() - started_at
+    # veBANK only decays, so the later timestamp gives the lower bound
+    lower = get_projected_vebank_amounts(amount_locked, lock_end_time, after)
+
+    tolerance = np.maximum(1, RELATIVE_TOLERANCE * np.abs(expected))
+    mismatched = (expected < lower - tolerance) | (expected > upper + tolerance)
+    return (
+        [address for address, m in zip(addresses, mismatched) if m],
+        sdk_seconds,
+        array_seconds,
+    )
+
+
+class BoostMultiplierProjection:
+    """Projected boost multipliers, memoized per governor. A projection only
+    depends on the voting escrow state, so each governor costs one sdk call
+    however many staking contracts it is in. Boost multipliers have no array
+    pass, they stay with the sdk.
+    """
+
+    def __init__(self, client, governor_state):
+        self.voting_escrow = client.governance.voting_escrow
+        self.governor_state = governor_state
+        self.boost_multipliers = {}
+
+    def get(self, governor_address):
+        if governor_address not in self.boost_multipliers:
+            self.boost_multipliers[
+                governor_address
+            ] = self.voting_escrow.get_projected_boost_multiplier(
+                UserVotingEscrowState(
+                    self.governor_state[governor_address]["voting_escrow"]
+                )
+            )
+        return self.boost_multipliers[governor_address]
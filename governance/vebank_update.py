@@ -1,5 +1,6 @@
 # basic imports
 import argparse
+from functools import partial
 from base64 import b64encode
 import time
 import os
@@ -24,6 +25,13 @@ from algofipy.transaction_utils import (
 from algofipy.staking.v2.staking_config import STAKING_CONFIGS
 from algofipy.governance.v1.user_voting_escrow_state import UserVotingEscrowState
 
+from governor_state import GovernorStateStore
+from vebank_projection import project_vebank, BoostMultiplierProjection
+from suggested_params import CachedParamsAlgod, DEFAULT_MAX_AGE
+from keeper_submitter import KeeperSubmitter, DEFAULT_MAX_IN_FLIGHT
+from keeper_packer import KeeperPacker, MAX_GROUP_SIZE
+from keeper_dry_run import DryRun
+
 
 def get_update_vebank_data_txns(client, sender, user_updating):
     params = get_default_params(client.algod)
@@ -111,48 +119,59 @@ if __name__ == "__main__":
     )
     parser.add_argument("--indexer_token", type=str, default="")
     parser.add_argument("--pct_threshold", type=int, default=5)
-    parser.add_argument("--env_fpath", type=str, required=True)
+    parser.add_argument("--env_fpath", type=str, default="")
+    parser.add_argument("--params_max_age", type=float, default=DEFAULT_MAX_AGE)
+    parser.add_argument("--max_in_flight", type=int, default=DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument("--max_group_size", type=int, default=MAX_GROUP_SIZE)
+    parser.add_argument("--governor_state_fpath", type=str, default="")
+    parser.add_argument("--array_vebank_projection", action="store_true")
+    parser.add_argument("--dry_run_fixtures", type=str, default="")
+    parser.add_argument("--record_fixtures", action="store_true")
     args = parser.parse_args()
-
-    env_vars = dotenv_values(args.env_fpath)
-    keeper_key = mnemonic.to_private_key(env_vars["mnemonic"])
+    if not args.env_fpath and not args.dry_run_fixtures:
+        parser.error("--env_fpath is required unless dry running")
+    if not 1 <= args.max_group_size <= MAX_GROUP_SIZE:
+        parser.error("--max_group_size must be between 1 and %d" % MAX_GROUP_SIZE)
+
+    dry_run = DryRun(args.dry_run_fixtures, args.record_fixtures)
+    dry_run.start_phase("setup")
+
+    if args.env_fpath:
+        env_vars = dotenv_values(args.env_fpath)
+        keeper_key = mnemonic.to_private_key(env_vars["mnemonic"])
+    else:
+        # dry runs sign with a throwaway key
+        keeper_key, _ = account.generate_account()
     keeper = account.address_from_private_key(keeper_key)
 
-    algod_client = AlgodClient(args.algod_token, args.algod_uri)
-    indexer_client = IndexerClient(args.indexer_token, args.indexer_uri)
+    algod_client, indexer_client = dry_run.wrap(
+        AlgodClient(args.algod_token, args.algod_uri),
+        IndexerClient(args.indexer_token, args.indexer_uri),
+    )
+    # builders share suggested params for --params_max_age seconds
+    algod_client = CachedParamsAlgod(algod_client, args.params_max_age)
     client = AlgofiClient(Network.MAINNET, algod_client, indexer_client)
+    submitter = KeeperSubmitter(client.algod, keeper_key, args.max_in_flight, dry_run)
+    packer = KeeperPacker(submitter, args.max_group_size)
 
     # update user vebank on voting escrow
+    dry_run.start_phase("governor state")
     print("Querying governance users...")
-    (
-        governor_admin_state,
-        storage_mapping,
-    ) = client.governance.get_governor_admin_state()
-    governor_voting_escrow_state = client.governance.get_governor_voting_escrow_state()
-    governor_addresses = list(
-        set(
-            list(governor_admin_state.keys())
-            + list(governor_voting_escrow_state.keys())
-        )
-    )
-    governor_state = {}
-    for governor_address in governor_addresses:
-        admin_state = governor_admin_state.get(governor_address, {})
-        voting_escrow_state = governor_voting_escrow_state.get(governor_address, {})
-        if admin_state and voting_escrow_state:
-            governor_state[governor_address] = {
-                "admin": admin_state,
-                "voting_escrow": voting_escrow_state,
-            }
+    governor_state, storage_mapping = GovernorStateStore(
+        client, args.governor_state_fpath
+    ).load()
 
+    dry_run.start_phase("veBANK updates")
     print("Updating veBANK...")
+    projected_vebank_amounts = project_vebank(
+        client, governor_state, args.array_vebank_projection
+    )
+    vebank_updates = {}
     for governor_address in governor_state:
         amount_vebank = governor_state[governor_address]["voting_escrow"][
             VOTING_ESCROW_STRINGS.user_amount_vebank
         ]
-        projected_vebank = client.governance.voting_escrow.get_projected_vebank_amount(
-            UserVotingEscrowState(governor_state[governor_address]["voting_escrow"])
-        )
+        projected_vebank = projected_vebank_amounts[governor_address]
         if amount_vebank > 0:
             pct_change = (projected_vebank - amount_vebank) / amount_vebank * 100
             if pct_change < -args.pct_threshold:
@@ -164,26 +183,25 @@ if __name__ == "__main__":
                     + " percent"
                 )
                 txn = get_update_vebank_data_txns(client, keeper, governor_address)
-                txn.sign_with_private_key(keeper_key)
-                txn.submit(client.algod, wait=False)
+                vebank_updates[governor_address] = packer.add(
+                    txn, "veBANK of " + governor_address
+                )
 
-    # wait for txns to settle
-    time.sleep(5)
+    packer.flush()
 
-    # get staking contracts
+    # get staking contracts, a boost update is sent as soon as the veBANK
+    # update of its governor has landed
+    dry_run.start_phase("boost multiplier updates")
     print("Updating boost multipliers...")
     staking_contracts = STAKING_CONFIGS[Network.MAINNET]
+    boost_multiplier_projection = BoostMultiplierProjection(client, governor_state)
     for staking_contract in staking_contracts:
         staking_app_id = staking_contract.app_id
         staking_data = client.staking.get_staking_state(staking_app_id)
         for address in staking_data:
             if not address in governor_state:
                 continue
-            projected_boost_multiplier = (
-                client.governance.voting_escrow.get_projected_boost_multiplier(
-                    UserVotingEscrowState(governor_state[address]["voting_escrow"])
-                )
-            )
+            projected_boost_multiplier = boost_multiplier_projection.get(address)
             staking_boost_multiplier = staking_data[address]["boost_multiplier"]
             if staking_boost_multiplier > 0:
                 pct_change = (
@@ -200,8 +218,21 @@ if __name__ == "__main__":
                         + " percent on "
                         + str(staking_app_id)
                     )
-                    txn = get_staking_update_boost_multiplier_txns(
-                        client, keeper, address, staking_app_id
+                    submitter.submit_after(
+                        [vebank_updates[address]] if address in vebank_updates else [],
+                        partial(
+                            get_staking_update_boost_multiplier_txns,
+                            client,
+                            keeper,
+                            address,
+                            staking_app_id,
+                        ),
+                        "boost multiplier of %s on %d" % (address, staking_app_id),
                     )
-                    txn.sign_with_private_key(keeper_key)
-                    txn.submit(client.algod, wait=False)
+
+    # wait for every update to land
+    dry_run.start_phase("submit")
+    packer.close()
+    submitter.close()
+    submitter.print_summary()
+    dry_run.close()
@@ -0,0 +1,152 @@
+# basic imports
+import argparse
+import random
+from time import perf_counter
+
+from event_extractor import (
+    LIQUIDATE_ARG,
+    SEIZE_COLLATERAL_ARG,
+    get_app_args,
+    group_transactions,
+    extract_events,
+    classify_v2_group,
+)
+
+# non liquidation market calls, base64 encoded
+OTHER_ARGS = ["Yg==", "cg==", "bWM=", "cmM="]
+MARKET_APP_IDS = list(range(818179346, 818179346 + 10))
+
+
+def make_txn(gid, txid, round_, **fields):
+    txn = {
+        "id": txid,
+        "group": gid,
+        "confirmed-round": round_,
+        "round-time": 1666000000 + round_ * 4,
+        "sender": "LIQUIDATOR",
+    }
+    txn.update(fields)
+    return txn
+
+
+def make_app_call(gid, txid, round_, app_id, arg, **fields):
+    app_txn = {"application-id": app_id, "application-args": [arg]}
+    app_txn.update(fields.pop("application_transaction", {}))
+    return make_txn(gid, txid, round_, **{"application-transaction": app_txn}, **fields)
+
+
+def make_synthetic_txns(n_groups, liquidation_share, seed=0):
+    """Returns V2 style indexer transactions. Like the events scripts, which
+    query both the market app id and the market address, every transaction of a
+    liquidation group is returned twice.
+    """
+    rng = random.Random(seed)
+    txns = []
+    for i in range(n_groups):
+        gid = "group-%d" % i
+        round_ = 25000000 + i // 4
+        if rng.random() < liquidation_share:
+            borrow_app_id, collateral_app_id = rng.sample(MARKET_APP_IDS, 2)
+            group = [
+                make_txn(
+                    gid,
+                    gid + "-0",
+                    round_,
+                    **{"payment-transaction": {"amount": rng.randint(1, 10**9)}}
+                ),
+                make_app_call(gid, gid + "-1", round_, borrow_app_id, LIQUIDATE_ARG),
+                make_app_call(
+                    gid,
+                    gid + "-2",
+                    round_,
+                    collateral_app_id,
+                    SEIZE_COLLATERAL_ARG,
+                    application_transaction={"accounts": ["LIQUIDATEE"]},
+                    **{
+                        "inner-txns": [
+                            {},
+                            {
+                                "asset-transfer-transaction": {
+                                    "amount": rng.randint(1, 10**9)
+                                }
+                            },
+                        ]
+                    }
+                ),
+            ]
+            txns.extend(group)
+            txns.extend(group)
+        else:
+            for j in range(rng.randint(1, 4)):
+                txns.append(
+                    make_app_call(
+                        gid,
+                        "%s-%d" % (gid, j),
+                        round_,
+                        rng.choice(MARKET_APP_IDS),
+                        rng.choice(OTHER_ARGS),
+                    )
+                )
+    return txns
+
+
+def legacy_extract(txns, classify_group):
+    # the list based scan the events scripts used before event_extractor
+    txns_by_group = {}
+    for txn in txns:
+        gid = txn.get("group", None)
+        txid = txn.get("id", None)
+        if gid in txns_by_group:
+            txns_by_group[gid][txid] = txn
+        else:
+            txns_by_group[gid] = {txid: txn}
+    groups_calced = []
+    events = []
+    for txn in txns:
+        app_args = get_app_args(txn)
+        if app_args:
+            if app_args[0] == LIQUIDATE_ARG:
+                gid = txn["group"]
+                if gid not in groups_calced:
+                    event = classify_group(gid, txns_by_group[gid])
+                    if event is not None:
+                        events.append(event)
+                    groups_calced.append(gid)
+    return events
+
+
+def single_pass_extract(txns, classify_group):
+    txns_by_group, liquidation_gids = group_transactions(txns)
+    events, _ = extract_events(txns_by_group, liquidation_gids, classify_group)
+    return events
+
+
+def time(func, *args):
+    start = perf_counter()
+    res = func(*args)
+    return res, perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Input processor")
+    parser.add_argument("--n_groups", type=str, default="10000,50000,100000")
+    parser.add_argument("--liquidation_share", type=float, default=0.2)
+    args = parser.parse_args()
+
+    for n_groups in map(int, args.n_groups.split(",")):
+        txns = make_synthetic_txns(n_groups, args.liquidation_share)
+        legacy_events, legacy_time = time(legacy_extract, txns, classify_v2_group)
+        events, single_pass_time = time(single_pass_extract, txns, classify_v2_group)
+        assert [event["group"] for event in events] == [
+            event["group"] for event in legacy_events
+        ]
+        print(
+            "%d txns, %d liquidations: legacy %.3fs, single pass %.3fs (%.1fx)"
+            % (
+                len(txns),
+                len(events),
+                legacy_time,
+                single_pass_time,
+                legacy_time / single_pass_time,
+            )
+        )
@@ -0,0 +1,152 @@
+# basic imports
+import argparse
+import json
+import random
+from base64 import b64decode, b64encode
+from time import perf_counter
+
+# algorand imports
+from algosdk.v2client.indexer import IndexerClient
+
+# algofi imports
+from algofipy.lending.v2.lending_config import MANAGER_STRINGS, MARKET_STRINGS
+
+from state_decoder import StateDecoder, get_state_key
+
+# the local state keys the liquidation report decodes
+WANTED_MARKET_KEYS = [
+    MARKET_STRINGS.user_borrow_shares,
+    MARKET_STRINGS.user_active_b_asset_collateral,
+]
+WANTED_KEYS = WANTED_MARKET_KEYS + [MANAGER_STRINGS.user_account]
+# stand ins for the other market local state keys of synthetic accounts
+MARKET_KEYS = WANTED_MARKET_KEYS + ["uubac", "ulsi", "ulbi", "uas"]
+MARKET_APP_IDS = list(range(818179346, 818179346 + 10))
+MANAGER_APP_ID = 818176933
+
+
+def make_synthetic_accounts(n_accounts, seed=0):
+    rng = random.Random(seed)
+    accounts = []
+    for i in range(n_accounts):
+        local_states = [
+            {
+                "id": MANAGER_APP_ID,
+                "key-value": [
+                    {
+                        "key": get_state_key(MANAGER_STRINGS.user_account),
+                        "value": {
+                            "type": 1,
+                            "bytes": b64encode(rng.randbytes(32)).decode("utf-8"),
+                            "uint": 0,
+                        },
+                    }
+                ],
+            }
+        ]
+        for app_id in rng.sample(MARKET_APP_IDS, rng.randint(1, 4)):
+            local_states.append(
+                {
+                    "id": app_id,
+                    "key-value": [
+                        {
+                            "key": get_state_key(key),
+                            "value": {
+                                "type": 2,
+                                "bytes": "",
+                                "uint": rng.randint(0, 10**12),
+                            },
+                        }
+                        for key in MARKET_KEYS
+                    ],
+                }
+            )
+        accounts.append({"address": "ACCOUNT%d" % i, "apps-local-state": local_states})
+    return accounts
+
+
+def record_accounts(indexer, manager_app_id, dump_fpath):
+    # pages every storage account of the manager into a json dump
+    accounts = []
+    next_page = ""
+    while next_page is not None:
+        account_data = indexer.accounts(
+            limit=1000,
+            next_page=next_page,
+            application_id=manager_app_id,
+            exclude="assets",
+        )
+        accounts.extend(account_data["accounts"])
+        next_page = account_data.get("next-token", None)
+    with open(dump_fpath, "w") as f:
+        json.dump(accounts, f)
+    return accounts
+
+
+def format_state_simple(state):
+    # the decoder the liquidation reports used before state_decoder
+    formatted = {}
+    for item in state:
+        key = item["key"]
+        value = item["value"]
+        if value["type"] == 1:
+            formatted[b64decode(key).decode("utf-8")] = value["bytes"]
+        else:
+            formatted[b64decode(key).decode("utf-8")] = value["uint"]
+    return formatted
+
+
+def decode_all(accounts, decode):
+    return [
+        decode(state.get("key-value", []))
+        for account in accounts
+        for state in account.get("apps-local-state", [])
+    ]
+
+
+def time(func, *args):
+    start = perf_counter()
+    res = func(*args)
+    return res, perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Input processor")
+    parser.add_argument("--dump_fpath", type=str, default="")
+    parser.add_argument("--record", action="store_true")
+    parser.add_argument(
+        "--indexer_uri", type=str, default="https://algoindexer.algoexplorerapi.io"
+    )
+    parser.add_argument("--indexer_token", type=str, default="")
+    parser.add_argument("--manager_app_id", type=int, default=MANAGER_APP_ID)
+    parser.add_argument("--n_accounts", type=int, default=50000)
+    args = parser.parse_args()
+    if args.record and not args.dump_fpath:
+        parser.error("--record requires --dump_fpath")
+
+    if args.record:
+        indexer_client = IndexerClient(args.indexer_token, args.indexer_uri)
+        accounts = record_accounts(indexer_client, args.manager_app_id, args.dump_fpath)
+    elif args.dump_fpath:
+        with open(args.dump_fpath, "r") as f:
+            accounts = json.load(f)
+    else:
+        accounts = make_synthetic_accounts(args.n_accounts)
+
+    decoder = StateDecoder(WANTED_KEYS)
+    legacy_states, legacy_time = time(decode_all, accounts, format_state_simple)
+    states, decoder_time = time(decode_all, accounts, decoder.decode)
+    assert states == [
+        {key: value for key, value in state.items() if key in WANTED_KEYS}
+        for state in legacy_states
+    ]
+    print(
+        "%d accounts, %d local states: legacy %.3fs, decoder %.3fs (%.1fx)"
+        % (
+            len(accounts),
+            len(states),
+            legacy_time,
+            decoder_time,
+            legacy_time / decoder_time,
+        )
+    )
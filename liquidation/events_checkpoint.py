@@ -0,0 +1,40 @@
+# the liquidation/ and threaded/ copies of this module are kept identical
+# basic imports
+import json
+import os
+import pandas as pd
+
+
+def load_checkpoint(fpath):
+    """Returns the checkpoint of an incremental liquidation events run
+
+    :param fpath: checkpoint json fpath
+    :type fpath: str
+    :return: dict with the last processed round, None on the first run
+    :rtype: dict
+    """
+    if not os.path.exists(fpath):
+        return {"last_round": None}
+    with open(fpath, "r") as f:
+        return json.load(f)
+
+
+def save_checkpoint(fpath, last_round):
+    # groups are atomic within a round, so no group straddles the checkpoint
+    # write to a temporary file first so a crash never leaves a torn checkpoint
+    tmp_fpath = fpath + ".tmp"
+    with open(tmp_fpath, "w") as f:
+        json.dump({"last_round": last_round}, f)
+    os.replace(tmp_fpath, fpath)
+
+
+def append_events(fpath, df):
+    # append new liquidation rows to the growing dataset. Rows are appended
+    # before the checkpoint is saved, so groups already in the dataset are
+    # dropped in case the last run stopped between the two
+    if not os.path.exists(fpath):
+        df.to_csv(fpath, index=False)
+        return
+    appended_groups = pd.read_csv(fpath, usecols=["Group"])["Group"]
+    df = df[~df["Group"].isin(appended_groups)]
+    df.to_csv(fpath, mode="a", header=False, index=False)
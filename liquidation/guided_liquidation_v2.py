@@ -1,5 +1,7 @@
 # basic imports
-import base64, json, requests, sys, argparse
+import base64, json, requests, sys, argparse, csv, copy
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
 from dotenv import dotenv_values
 
 # formating helper
@@ -13,12 +15,19 @@ from algosdk.v2client.indexer import IndexerClient
 # algofi imports
 from algofipy.algofi_client import AlgofiClient
 from algofipy.globals import Network
+from algofipy.lending.v2.lending_config import MANAGER_STRINGS
 from algofipy.transaction_utils import wait_for_confirmation
 
+from state_decoder import StateDecoder
+from suggested_params import CachedParamsAlgod, DEFAULT_MAX_AGE
+from opportunity_ranker import ALGO_ASSET_ID, DEFAULT_ALGO_RESERVE
+
 # constants
 SCALE_FACTOR = 1000000000
 PARAMETER_SCALE_FACTOR = 1000
 DEFAULT_TAKE_PERCENTAGE = 0.5
+REFRESH_THREADS = 8
+MANAGER_STATE_DECODER = StateDecoder([MANAGER_STRINGS.user_account])
 
 # helpers
 def is_number(string):
@@ -193,6 +202,238 @@ def display_target_data(
     print(state_table)
 
 
+def get_primary_address(account, manager_app_id):
+    # the manager local state of a storage account holds its primary address
+    for state in account.get("apps-local-state", []):
+        if state["id"] == manager_app_id:
+            values = MANAGER_STATE_DECODER.decode(state.get("key-value", []))
+            if MANAGER_STRINGS.user_account in values:
+                return encoding.encode_address(
+                    base64.b64decode(values[MANAGER_STRINGS.user_account])
+                )
+    return None
+
+
+def refresh_target(algofi_client, storage_address, executor, market_lock):
+    """Reloads one liquidatee and only the markets its storage account has
+    state on, instead of the whole protocol. Prices of the other markets keep
+    their last loaded values.
+
+    :param executor: pool the market reads run on
+    :type executor: :class:`ThreadPoolExecutor`
+    :param market_lock: held while the shared markets are reloaded and the
+        liquidatee is read from them
+    :type market_lock: :class:`Lock`
+    :return: (liquidatee user, list of refreshed market app ids)
+    :rtype: tuple
+    """
+    markets = algofi_client.lending.markets
+    # one read gives both the markets to reload and the primary address
+    account_info = algofi_client.algod.account_info(storage_address)
+    primary_address = get_primary_address(
+        account_info, algofi_client.lending.manager_config.app_id
+    )
+    if primary_address is None:
+        raise ValueError("%s is not a storage account" % storage_address)
+    market_app_ids = [
+        state["id"]
+        for state in account_info.get("apps-local-state", [])
+        if state["id"] in markets
+    ]
+    # concurrent refreshes share the market objects
+    with market_lock:
+        list(executor.map(lambda app_id: markets[app_id].load_state(), market_app_ids))
+        liquidatee_user = algofi_client.lending.get_user(primary_address)
+    return liquidatee_user, market_app_ids
+
+
+def burn_seized_collateral(algod_client, liquidator_user, liquidator_key, seize_market):
+    # redeem the b asset collateral seized by a liquidation for its underlying
+    liquidator_user.load_state()
+    user_b_asset_balance = liquidator_user.balances.get(seize_market.b_asset_id, 0)
+    if user_b_asset_balance > 0:
+        burn_group = seize_market.get_burn_txns(
+            liquidator_user.lending, user_b_asset_balance
+        )
+        burn_group.sign_with_private_key(liquidator_key)
+        burn_txid = algod_client.send_transactions(burn_group.signed_transactions)
+        wait_for_confirmation(algod_client, burn_txid)
+
+
+def load_targets(targets_fpath):
+    """Loads liquidation targets, e.g. the opportunity_ranker.py csv
+
+    :param targets_fpath: csv with Storage Account, Repay Symbol, Seize Symbol
+        and Repay Amount (base units of the repay asset) columns
+    :type targets_fpath: str
+    :return: list of target dicts
+    :rtype: list
+    """
+    with open(targets_fpath, "r") as f:
+        return [
+            {
+                "storage_address": row["Storage Account"],
+                "repay_symbol": row["Repay Symbol"],
+                "seize_symbol": row["Seize Symbol"],
+                "repay_amount": int(float(row["Repay Amount"])),
+            }
+            for row in csv.DictReader(f)
+        ]
+
+
+class AutoLiquidator:
+    """Liquidates a list of targets without prompts. Up to max_concurrent
+    liquidations are built, signed and submitted at once, each waits for its
+    confirmation on its own thread and then burns the seized collateral.
+    Repay amounts are reserved from the liquidator balances so concurrent
+    liquidations never overspend an asset, and algo_reserve microALGO are
+    never repaid so fees can still be paid. A reservation is only released
+    once its group was rejected or can no longer land.
+    """
+
+    def __init__(
+        self,
+        algofi_client,
+        liquidator_user,
+        liquidator_key,
+        max_concurrent=4,
+        algo_reserve=DEFAULT_ALGO_RESERVE,
+    ):
+        self.algofi_client = algofi_client
+        self.algod_client = algofi_client.algod
+        self.liquidator_user = liquidator_user
+        self.liquidator_key = liquidator_key
+        self.max_concurrent = max_concurrent
+        self.algo_reserve = algo_reserve
+        self.market_name_to_id = get_market_name_to_id(algofi_client)
+        self.lock = Lock()
+        # burns reload the liquidator state, one at a time and on their own
+        # user object, as other threads build groups from liquidator_user
+        self.burn_lock = Lock()
+        self.burn_user = algofi_client.get_user(liquidator_user.address)
+        self.balances = {}
+        self.market_lock = Lock()
+        # separate from the liquidation pool so refreshes never wait on it
+        self.refresh_executor = ThreadPoolExecutor(max_workers=REFRESH_THREADS)
+
+    def reserve(self, asset_id, amount):
+        with self.lock:
+            amount = min(amount, self.balances.get(asset_id, 0))
+            self.balances[asset_id] = self.balances.get(asset_id, 0) - amount
+            return amount
+
+    def release(self, asset_id, amount):
+        with self.lock:
+            self.balances[asset_id] = self.balances.get(asset_id, 0) + amount
+
+    def wait_for_final_status(self, txid, last_valid):
+        """Waits until a sent group is confirmed, rejected from the pool or past
+        its last valid round. Errors are raised without a status, since the
+        group may still land.
+
+        :return: confirmed, failed with the pool error or expired
+        :rtype: str
+        """
+        round_ = self.algod_client.status()["last-round"]
+        while True:
+            try:
+                info = self.algod_client.pending_transaction_info(txid)
+            except Exception:
+                # dropped from the pool, it can still land until its last round
+                info = {}
+            if info.get("confirmed-round", 0) > 0:
+                return "confirmed"
+            if info.get("pool-error", ""):
+                return "failed: %s" % info["pool-error"]
+            if round_ > last_valid:
+                return "expired"
+            round_ = self.algod_client.status_after_block(round_)["last-round"]
+
+    def liquidate(self, target):
+        markets = self.algofi_client.lending.markets
+        repay_market = markets[self.market_name_to_id[target["repay_symbol"]]]
+        seize_market = markets[self.market_name_to_id[target["seize_symbol"]]]
+        liquidatee_user, _ = refresh_target(
+            self.algofi_client,
+            target["storage_address"],
+            self.refresh_executor,
+            self.market_lock,
+        )
+        if liquidatee_user.net_borrow < liquidatee_user.net_scaled_collateral:
+            return "healthy"
+        asset_id = repay_market.underlying_asset_id
+        decimals = 10 ** self.algofi_client.assets[asset_id].decimals
+        # the target amount may predate other liquidations of the account, so
+        # the close factor is applied to the current borrow again
+        max_liquidation = int(
+            DEFAULT_TAKE_PERCENTAGE
+            * liquidatee_user.user_market_states[
+                repay_market.app_id
+            ].borrowed_underlying.underlying
+            * decimals
+        )
+        repay_amount = self.reserve(
+            asset_id, min(target["repay_amount"], max_liquidation)
+        )
+        if repay_amount <= 0:
+            return "no balance"
+        try:
+            liq_group = repay_market.get_liquidate_txns(
+                self.liquidator_user.lending,
+                liquidatee_user,
+                repay_amount,
+                seize_market,
+            )
+            liq_group.sign_with_private_key(self.liquidator_key)
+            liq_txid = self.algod_client.send_transactions(
+                liq_group.signed_transactions
+            )
+        except:
+            # rejected by the node, so the balance is still there
+            self.release(asset_id, repay_amount)
+            raise
+        status = self.wait_for_final_status(
+            liq_txid, liq_group.transactions[0].last_valid_round
+        )
+        if status != "confirmed":
+            # the repay can no longer land, so the balance is still there
+            self.release(asset_id, repay_amount)
+            return status
+        with self.burn_lock:
+            burn_seized_collateral(
+                self.algod_client,
+                self.burn_user,
+                self.liquidator_key,
+                seize_market,
+            )
+        return "liquidated %d %s" % (repay_amount, repay_market.name)
+
+    def run(self, targets):
+        self.liquidator_user.load_state()
+        self.balances = dict(self.liquidator_user.balances)
+        self.balances[ALGO_ASSET_ID] = max(
+            0, self.balances.get(ALGO_ASSET_ID, 0) - self.algo_reserve
+        )
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            futures = {
+                executor.submit(self.liquidate, target): target for target in targets
+            }
+            for future in as_completed(futures):
+                target = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = "failed: %s" % e
+                print(
+                    "{} repay {} seize {}: {}".format(
+                        target["storage_address"],
+                        target["repay_symbol"],
+                        target["seize_symbol"],
+                        result,
+                    )
+                )
+
+
 if __name__ == "__main__":
     # get network from user
     parser = argparse.ArgumentParser(description="Input processor")
@@ -205,7 +446,14 @@ if __name__ == "__main__":
     )
     parser.add_argument("--indexer_token", type=str, default="")
     parser.add_argument("--env_fpath", type=str, required=True)
+    parser.add_argument("--auto", action="store_true")
+    parser.add_argument("--targets_fpath", type=str, default="")
+    parser.add_argument("--max_concurrent", type=int, default=4)
+    parser.add_argument("--params_max_age", type=float, default=DEFAULT_MAX_AGE)
+    parser.add_argument("--algo_reserve", type=int, default=DEFAULT_ALGO_RESERVE)
     args = parser.parse_args()
+    if args.auto and not args.targets_fpath:
+        parser.error("--auto requires --targets_fpath")
 
     # load in mnemonic
     env_vars = dotenv_values(args.env_fpath)
@@ -213,11 +461,26 @@ if __name__ == "__main__":
     liquidator_address = account.address_from_private_key(liquidator_key)
 
     algod_client = AlgodClient(args.algod_token, args.algod_uri)
+    if args.auto:
+        algod_client = CachedParamsAlgod(algod_client, args.params_max_age)
     indexer_client = IndexerClient(args.indexer_token, args.indexer_uri)
     algofi_client = AlgofiClient(Network.MAINNET, algod_client, indexer_client)
     liquidator_user = algofi_client.get_user(liquidator_address)
 
+    if args.auto:
+        auto_liquidator = AutoLiquidator(
+            algofi_client,
+            liquidator_user,
+            liquidator_key,
+            args.max_concurrent,
+            args.algo_reserve,
+        )
+        auto_liquidator.run(load_targets(args.targets_fpath))
+        sys.exit(0)
+
     market_name_to_id = get_market_name_to_id(algofi_client)
+    refresh_executor = ThreadPoolExecutor(max_workers=REFRESH_THREADS)
+    market_lock = Lock()
 
     # liquidation loop
     target_address = None
@@ -231,22 +494,19 @@ if __name__ == "__main__":
         ):
             target_address = input("Enter liquidatee storage account target address: ")
 
-        algofi_client.lending.load_state()
-
-        print("loading target state...")
+        print("loading target state and balances...")
+        liquidator_future = refresh_executor.submit(liquidator_user.load_state)
         try:
-            liquidatee_primary_address = algofi_client.lending.get_user_account(
-                target_address
+            liquidatee_user, _ = refresh_target(
+                algofi_client, target_address, refresh_executor, market_lock
             )
-            liquidatee_user = algofi_client.lending.get_user(liquidatee_primary_address)
         except:
             print("Failed to load user with storage account address " + target_address)
             continue
 
         print("loading prices...")
         prices = get_prices(algofi_client)
-        print("loading balances...")
-        liquidator_user.load_state()
+        liquidator_future.result()
         liquidator_balances = load_borrowable_balances(liquidator_user)
 
         display_balance_data(algofi_client, liquidator_balances, prices)
@@ -313,22 +573,14 @@ if __name__ == "__main__":
             continue
 
         # burn
-        user = algofi_client.get_user(liquidator_address)
-        user_b_asset_balance = liquidator_user.balances(seize_market.b_asset_id)
-        if user_b_asset_balance > 0:
-            burn_group = seize_market.get_burn_txns(
-                liquidator_user.lending, user_b_asset_balance
+        try:
+            burn_seized_collateral(
+                algod_client, liquidator_user, liquidator_key, seize_market
+            )
+        except:
+            print(
+                "Failed to burn "
+                + seize_market.name
+                + " bAsset collateral from liquidation of "
+                + target_address
             )
-            burn_group.sign_with_private_key(liquidator_key)
-            try:
-                burn_txid = algod_client.send_transactions(
-                    burn_group.signed_transactions
-                )
-                wait_for_confirmation(algod_client, burn_txid)
-            except:
-                print(
-                    "Failed to burn "
-                    + seize_market.name
-                    + " bAsset collateral from liquidation of "
-                    + target_address
-                )
@@ -0,0 +1,267 @@
+# basic imports
+from base64 import b64decode
+import numpy as np
+import pandas as pd
+
+# algorand imports
+from algosdk.encoding import encode_address
+
+# algofi imports
+from algofipy.lending.v2.lending_config import MANAGER_STRINGS, MARKET_STRINGS
+
+from state_decoder import StateDecoder
+
+ROUND_DECIMALS = 3
+
+
+MARKET_STATE_DECODER = StateDecoder(
+    [MARKET_STRINGS.user_borrow_shares, MARKET_STRINGS.user_active_b_asset_collateral]
+)
+MANAGER_STATE_DECODER = StateDecoder([MANAGER_STRINGS.user_account])
+
+
+VECTOR_FIELDS = [
+    "decimals",
+    "borrow_share_rate",
+    "b_asset_rate",
+    "usd_price",
+    "borrow_factor",
+    "collateral_factor",
+]
+
+
+class MarketVectors:
+    """Per market values of the V2 markets, one entry per market in a fixed
+    order, so a user state is a row of per market amounts.
+    """
+
+    def __init__(
+        self,
+        app_ids,
+        names,
+        decimals,
+        borrow_share_rate,
+        b_asset_rate,
+        usd_price,
+        borrow_factor,
+        collateral_factor,
+    ):
+        self.app_ids = list(app_ids)
+        self.index = {app_id: i for i, app_id in enumerate(self.app_ids)}
+        self.names = list(names)
+        self.decimals = np.asarray(decimals, dtype=np.float64)
+        # underlying per borrow share and per b asset
+        self.borrow_share_rate = np.asarray(borrow_share_rate, dtype=np.float64)
+        self.b_asset_rate = np.asarray(b_asset_rate, dtype=np.float64)
+        # usd per base unit of the underlying
+        self.usd_price = np.asarray(usd_price, dtype=np.float64)
+        self.borrow_factor = np.asarray(borrow_factor, dtype=np.float64)
+        self.collateral_factor = np.asarray(collateral_factor, dtype=np.float64)
+
+
+def get_market_vectors(algofi_client):
+    app_ids = list(algofi_client.lending.markets.keys())
+    markets = [algofi_client.lending.markets[app_id] for app_id in app_ids]
+    return MarketVectors(
+        app_ids,
+        [market.name for market in markets],
+        [
+            algofi_client.assets[market.underlying_asset_id].decimals
+            for market in markets
+        ],
+        [
+            market.underlying_borrowed / market.borrow_share_circulation
+            if market.borrow_share_circulation != 0
+            else 0
+            for market in markets
+        ],
+        [
+            market.get_underlying_supplied() / market.b_asset_circulation
+            if market.b_asset_circulation != 0
+            else 0
+            for market in markets
+        ],
+        [market.underlying_to_usd(1e9) / 1e9 for market in markets],
+        [market.borrow_factor / 1000 for market in markets],
+        [market.collateral_factor / 1000 for market in markets],
+    )
+
+
+class HealthBook:
+    """Dense (users x markets) borrow shares and b asset collateral of every
+    storage account with local state on at least one market.
+    """
+
+    def __init__(self, storage_addresses, primary_addresses, borrow_shares, collateral):
+        self.storage_addresses = storage_addresses
+        self.primary_addresses = primary_addresses
+        self.borrow_shares = borrow_shares
+        self.collateral = collateral
+
+
+def decode_account(account, market_index, manager_app_id):
+    """Decodes the local states of one storage account
+
+    :return: (storage address, primary address, list of (market index, borrow
+        shares, b asset collateral)) or None if the account has no market state
+    :rtype: tuple
+    """
+    if "apps-local-state" not in account:
+        # this means the app has closed out of the protocol
+        return None
+    primary_address = ""
+    market_states = []
+    for state in account["apps-local-state"]:
+        if state["id"] in market_index:
+            values = MARKET_STATE_DECODER.decode(state.get("key-value", []))
+            market_states.append(
+                (
+                    market_index[state["id"]],
+                    values.get(MARKET_STRINGS.user_borrow_shares, 0),
+                    values.get(MARKET_STRINGS.user_active_b_asset_collateral, 0),
+                )
+            )
+        elif state["id"] == manager_app_id:
+            values = MANAGER_STATE_DECODER.decode(state.get("key-value", []))
+            if MANAGER_STRINGS.user_account in values:
+                primary_address = encode_address(
+                    b64decode(values[MANAGER_STRINGS.user_account])
+                )
+    if not market_states:
+        return None
+    return account["address"], primary_address, market_states
+
+
+def build_health_book(decoded_accounts, n_markets):
+    decoded_accounts = [decoded for decoded in decoded_accounts if decoded is not None]
+    borrow_shares = np.zeros((len(decoded_accounts), n_markets))
+    collateral = np.zeros((len(decoded_accounts), n_markets))
+    rows, cols, shares, b_assets = [], [], [], []
+    for row, (_, _, market_states) in enumerate(decoded_accounts):
+        for col, borrow_share_amount, b_asset_amount in market_states:
+            rows.append(row)
+            cols.append(col)
+            shares.append(borrow_share_amount)
+            b_assets.append(b_asset_amount)
+    # float64 like the python engine, amounts stay far below 2**53
+    borrow_shares[rows, cols] = shares
+    collateral[rows, cols] = b_assets
+    return HealthBook(
+        [decoded[0] for decoded in decoded_accounts],
+        [decoded[1] for decoded in decoded_accounts],
+        borrow_shares,
+        collateral,
+    )
+
+
+def save_health_book(fpath, book, vectors):
+    # one account scan can be reused by later runs, e.g. price shock simulations
+    # a file object keeps numpy from appending .npz to the path
+    with open(fpath, "wb") as f:
+        np.savez_compressed(
+            f,
+            storage_addresses=np.array(book.storage_addresses, dtype=str),
+            primary_addresses=np.array(book.primary_addresses, dtype=str),
+            borrow_shares=book.borrow_shares,
+            collateral=book.collateral,
+            app_ids=np.array(vectors.app_ids, dtype=np.int64),
+            names=np.array(vectors.names, dtype=str),
+            **{field: getattr(vectors, field) for field in VECTOR_FIELDS}
+        )
+
+
+def load_health_book(fpath):
+    """Loads a book saved by save_health_book
+
+    :return: (book, vectors) as of the scan which saved them
+    :rtype: tuple
+    """
+    with np.load(fpath) as data:
+        book = HealthBook(
+            data["storage_addresses"].tolist(),
+            data["primary_addresses"].tolist(),
+            data["borrow_shares"],
+            data["collateral"],
+        )
+        vectors = MarketVectors(
+            data["app_ids"].tolist(),
+            data["names"].tolist(),
+            *[data[field] for field in VECTOR_FIELDS]
+        )
+    return book, vectors
+
+
+def compute_health(book, vectors):
+    """Returns the underlying and usd amounts per user and market, and the
+    scaled borrow, max borrow and health ratio per user
+    """
+    borrow_underlying = book.borrow_shares * vectors.borrow_share_rate
+    collateral_underlying = book.collateral * vectors.b_asset_rate
+    borrow_usd = borrow_underlying * vectors.usd_price
+    collateral_usd = collateral_underlying * vectors.usd_price
+    borrow = borrow_usd @ vectors.borrow_factor
+    max_borrow = collateral_usd @ vectors.collateral_factor
+    health_ratio = np.divide(
+        borrow, max_borrow, out=np.zeros_like(borrow), where=max_borrow != 0
+    )
+    return {
+        "borrow_underlying": borrow_underlying,
+        "collateral_underlying": collateral_underlying,
+        "borrow_usd": borrow_usd,
+        "collateral_usd": collateral_usd,
+        "borrow": borrow,
+        "max_borrow": max_borrow,
+        "health_ratio": health_ratio,
+    }
+
+
+def process_health_book(
+    timestamp, book, vectors, health_ratio_threshold, dollarized_borrow_threshold
+):
+    """Same summary and drilldown tables as process_liquidation_data, filtered
+    and laid out with array ops
+    """
+    health = compute_health(book, vectors)
+    borrow = np.round(health["borrow"], ROUND_DECIMALS)
+    max_borrow = np.round(health["max_borrow"], ROUND_DECIMALS)
+    users = np.flatnonzero(
+        (borrow >= max_borrow * health_ratio_threshold)
+        & (borrow >= dollarized_borrow_threshold)
+        & (borrow != 0)
+        & (max_borrow != 0)
+    )
+    storage_addresses = np.array(book.storage_addresses, dtype=object)
+    summary_df = pd.DataFrame(
+        {
+            "Storage Account": storage_addresses[users],
+            "Max Borrow": max_borrow[users],
+            "Borrow": borrow[users],
+            "Health Ratio": np.round(health["health_ratio"][users], ROUND_DECIMALS),
+        }
+    ).sort_values("Health Ratio", ascending=False)
+
+    # one row per user and market with a position, in user then market order
+    borrow_usd = health["borrow_usd"][users]
+    collateral_usd = health["collateral_usd"][users]
+    rows, cols = np.nonzero((borrow_usd > 0) | (collateral_usd > 0))
+    scale = 10**vectors.decimals
+    drilldown_df = pd.DataFrame(
+        {
+            "Storage Account": storage_addresses[users[rows]],
+            "Symbol": np.array(vectors.names, dtype=object)[cols],
+            "Collateral": np.round(
+                health["collateral_underlying"][users[rows], cols] / scale[cols],
+                ROUND_DECIMALS,
+            ),
+            "Borrow": np.round(
+                health["borrow_underlying"][users[rows], cols] / scale[cols],
+                ROUND_DECIMALS,
+            ),
+            "Collateral (USD)": np.round(collateral_usd[rows, cols], ROUND_DECIMALS),
+            "Borrow (USD)": np.round(borrow_usd[rows, cols], ROUND_DECIMALS),
+        }
+    )
+    drilldown_df["Timestamp"] = timestamp
+    summary_df["Timestamp"] = timestamp
+
+    return (summary_df, drilldown_df)
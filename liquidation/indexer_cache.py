@@ -0,0 +1,146 @@
+# the liquidation/ and threaded/ copies of this module are kept identical
+# basic imports
+import json
+import sqlite3
+import zlib
+
+
+def search_all_transactions(search_func, min_round, max_round, **kwargs):
+    # page through every transaction matching the search
+    txns = []
+    next_page = ""
+    while next_page is not None:
+        txns_ = search_func(
+            next_page=next_page, min_round=min_round, max_round=max_round, **kwargs
+        )
+        txns.extend(txns_.get("transactions", []))
+        next_page = txns_.get("next-token", None)
+    return txns
+
+
+class IndexerCache:
+    """On-disk cache of indexer transaction searches, stored as compressed
+    pages in SQLite keyed by query and round range. Finalized rounds never
+    change, so a cached query only fetches rounds outside its cached range.
+    """
+
+    def __init__(self, fpath):
+        self.connection = sqlite3.connect(fpath)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "query_key TEXT NOT NULL, "
+            "min_round INTEGER NOT NULL, "
+            "max_round INTEGER NOT NULL, "
+            "txns BLOB NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS pages_by_query ON pages (query_key, min_round)"
+        )
+        self.connection.commit()
+        self.rounds_fetched = 0
+        self.rounds_cached = 0
+
+    def get_query_key(self, search_func, **kwargs):
+        params = {
+            key: value
+            for key, value in kwargs.items()
+            if key not in ["limit", "next_page"]
+        }
+        return "%s:%s" % (search_func.__name__, json.dumps(params, sort_keys=True))
+
+    def get_cached_range(self, query_key):
+        return self.connection.execute(
+            "SELECT MIN(min_round), MAX(max_round) FROM pages WHERE query_key = ?",
+            (query_key,),
+        ).fetchone()
+
+    def store_page(self, query_key, min_round, max_round, txns):
+        self.connection.execute(
+            "INSERT INTO pages VALUES (?, ?, ?, ?)",
+            (
+                query_key,
+                min_round,
+                max_round,
+                zlib.compress(json.dumps(txns).encode("utf-8")),
+            ),
+        )
+        self.rounds_fetched += max_round - min_round + 1
+
+    def load_pages(self, query_key, min_round, max_round):
+        txns = []
+        rows = self.connection.execute(
+            "SELECT txns FROM pages WHERE query_key = ? AND max_round >= ? "
+            "AND min_round <= ? ORDER BY min_round",
+            (query_key, min_round, max_round),
+        )
+        for (data,) in rows:
+            for txn in json.loads(zlib.decompress(data)):
+                if min_round <= txn.get("confirmed-round", min_round) <= max_round:
+                    txns.append(txn)
+        return txns
+
+    def search_transactions(
+        self, search_func, min_round, max_round, fetch=search_all_transactions, **kwargs
+    ):
+        """Returns all transactions of the search in [min_round, max_round],
+        fetching only the rounds the cache does not hold yet.
+
+        :param search_func: indexer search method, e.g. indexer.search_transactions
+        :param fetch: function(search_func, min_round, max_round, **kwargs) returning
+            the list of transactions in the range, defaults to plain paging
+        :return: list of transactions ordered by round range
+        """
+        query_key = self.get_query_key(search_func, **kwargs)
+        cached_min, cached_max = self.get_cached_range(query_key)
+
+        # only ever keep one contiguous range per query
+        if (
+            cached_min is None
+            or max_round < cached_min - 1
+            or min_round > cached_max + 1
+        ):
+            self.connection.execute(
+                "DELETE FROM pages WHERE query_key = ?", (query_key,)
+            )
+            missing_ranges = [(min_round, max_round)]
+        else:
+            missing_ranges = []
+            if min_round < cached_min:
+                missing_ranges.append((min_round, cached_min - 1))
+            if max_round > cached_max:
+                missing_ranges.append((cached_max + 1, max_round))
+            self.rounds_cached += (
+                min(max_round, cached_max) - max(min_round, cached_min) + 1
+            )
+
+        for (range_min, range_max) in missing_ranges:
+            txns = fetch(search_func, range_min, range_max, **kwargs)
+            self.store_page(query_key, range_min, range_max, txns)
+
+        # drop pages which fell out of the lookback window
+        self.connection.execute(
+            "DELETE FROM pages WHERE query_key = ? AND max_round < ?",
+            (query_key, min_round),
+        )
+        self.connection.commit()
+
+        return self.load_pages(query_key, min_round, max_round)
+
+    def close(self):
+        self.connection.close()
+
+
+def get_transactions(
+    indexer_cache,
+    search_func,
+    min_round,
+    max_round,
+    fetch=search_all_transactions,
+    **kwargs
+):
+    # go through the cache when one is configured
+    if indexer_cache is None:
+        return fetch(search_func, min_round, max_round, **kwargs)
+    return indexer_cache.search_transactions(
+        search_func, min_round, max_round, fetch=fetch, **kwargs
+    )
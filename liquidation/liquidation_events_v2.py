@@ -4,6 +4,10 @@ import pandas as pd
 import argparse
 from pytz import timezone
 from datetime import datetime
+from indexer_cache import IndexerCache, get_transactions
+from event_extractor import group_transactions, extract_events, classify_v2_group
+from market_snapshot import get_market_snapshot
+from events_checkpoint import load_checkpoint, save_checkpoint, append_events
 
 # algorand imports
 from algosdk.encoding import encode_address, decode_address
@@ -24,6 +28,28 @@ def get_time(tz="EST"):
     return ts
 
 
+def get_liquidation_event(snapshot, event):
+    # convert a raw liquidation event to dollarized amounts
+    borrow_market = snapshot[event["borrow_app_id"]]
+    collateral_market = snapshot[event["collateral_app_id"]]
+    collateral_seized_amount = event["collateral_seized"]
+    if event["collateral_is_bank_asset"]:
+        collateral_seized_amount *= collateral_market.b_asset_exchange_rate
+    collateral_seized_amount /= 10**collateral_market.decimals
+    repay_amount = event["repay_amount"] / 10**borrow_market.decimals
+    return {
+        "Time": event["time"],
+        "Group": event["group"],
+        "Liquidator": event["liquidator"],
+        "Liquidatee": event["liquidatee"],
+        "Borrow Market": borrow_market.name,
+        "Collateral Market": collateral_market.name,
+        "Repay Amount": repay_amount,
+        "Collateral Seized": collateral_seized_amount,
+        "Profit [$]": 0.07 * repay_amount * borrow_market.price,
+    }
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Input processor")
     parser.add_argument(
@@ -36,11 +62,14 @@ if __name__ == "__main__":
     parser.add_argument("--indexer_token", type=str, default="")
     parser.add_argument("--block_delta", type=int, default=20000)
     parser.add_argument("--csv_fpath", type=str, required=True)
+    parser.add_argument("--cache_fpath", type=str, default="")
+    parser.add_argument("--incremental", action="store_true")
     args = parser.parse_args()
 
     # initialize clients
     algod_client = AlgodClient(args.algod_token, args.algod_uri)
     indexer_client = IndexerClient(args.indexer_token, args.indexer_uri)
+    indexer_cache = IndexerCache(args.cache_fpath) if args.cache_fpath else None
     algofi_client = AlgofiClient(Network.MAINNET, algod_client, indexer_client)
 
     current_round = algofi_client.indexer.health()["round"]
@@ -54,42 +83,39 @@ if __name__ == "__main__":
     timestamp = get_time()
 
     # get transaction in each market
-    txns_by_group = {}
     txns = []
+
+    # resume after the last processed round
+    checkpoint_fpath = args.csv_fpath + "v2-liquidation-events-checkpoint.json"
+    if args.incremental:
+        checkpoint = load_checkpoint(checkpoint_fpath)
+        if checkpoint["last_round"] is not None:
+            start_round = checkpoint["last_round"] + 1
     for i, _ in enumerate(market_app_ids):
         market_app_id = market_app_ids[i]
         market_address = market_addresses[i]
-        next_page = ""
-        while next_page is not None:
-            txns_ = algofi_client.indexer.search_transactions(
-                next_page=next_page,
-                min_round=start_round,
-                max_round=current_round,
+        txns.extend(
+            get_transactions(
+                indexer_cache,
+                algofi_client.indexer.search_transactions,
+                start_round,
+                current_round,
                 application_id=market_app_id,
             )
-            txns.extend(txns_.get("transactions", []))
-            next_page = txns_.get("next-token", None)
-        next_page = ""
-        while next_page is not None:
-            txns_ = algofi_client.indexer.search_transactions_by_address(
-                market_address,
-                next_page=next_page,
-                min_round=start_round,
-                max_round=current_round,
+        )
+        txns.extend(
+            get_transactions(
+                indexer_cache,
+                algofi_client.indexer.search_transactions_by_address,
+                start_round,
+                current_round,
+                address=market_address,
             )
-            txns.extend(txns_.get("transactions", []))
-            next_page = txns_.get("next-token", None)
-    # create by gid dict
-    for txn in txns:
-        gid = txn.get("group", None)
-        txid = txn.get("id", None)
-        if gid in txns_by_group:
-            txns_by_group[gid][txid] = txn
-        else:
-            txns_by_group[gid] = {txid: txn}
+        )
+    # group once and classify every liquidation group once
+    txns_by_group, liquidation_gids = group_transactions(txns)
+    events, _ = extract_events(txns_by_group, liquidation_gids, classify_v2_group)
 
-    # identify liquidate transactions
-    groups_calced = []
     data_dict = {
         "Time": [],
         "Group": [],
@@ -101,96 +127,15 @@ if __name__ == "__main__":
         "Collateral Seized": [],
         "Profit [$]": [],
     }
-    for txn in txns:
-        app_args = txn.get("application-transaction", {}).get("application-args", [])
-        if app_args:
-            # liquidate or liquidate_update transaction
-            if app_args[0] == "bA==":
-                # get gid
-                gid = txn["group"]
-                if gid not in groups_calced:
-                    for liq_txn_id in txns_by_group[gid]:
-                        liq_txn = txns_by_group[gid][liq_txn_id]
-                        unix_time = liq_txn["round-time"]
-                        round_ = liq_txn["confirmed-round"]
-                        timestamp = datetime.fromtimestamp(unix_time)
-                        app_args = liq_txn.get("application-transaction", {}).get(
-                            "application-args", []
-                        )
-                        if app_args:
-                            if app_args[0] == "bA==":
-                                borrow_app_id = liq_txn["application-transaction"][
-                                    "application-id"
-                                ]
-                                borrow_market = market_id_to_name[borrow_app_id]
-                                borrow_price = (
-                                    markets[borrow_app_id].oracle.raw_price / 1000000
-                                )
-                            elif app_args[0] == "c2M=":
-                                accounts = liq_txn.get(
-                                    "application-transaction", {}
-                                ).get("accounts", [])
-                                liquidatee = accounts[0]
-                                liquidator = liq_txn["sender"]
-                                market_app_id = liq_txn["application-transaction"][
-                                    "application-id"
-                                ]
-                                collateral_market = market_id_to_name[market_app_id]
-                                inner_txn = liq_txn["inner-txns"][1]
-                                asset_transfer_txn = inner_txn.get(
-                                    "asset-transfer-transaction", {}
-                                )
-                                if asset_transfer_txn:
-                                    collateral_seized_amount = asset_transfer_txn[
-                                        "amount"
-                                    ]
-                                    bank_to_exchange_rate = (
-                                        markets[market_app_id]
-                                        .b_asset_to_asset_amount(1e9)
-                                        .underlying
-                                        / 1e9
-                                    )
-                                    collateral_seized_amount *= bank_to_exchange_rate
-                                else:
-                                    collateral_seized_amount = inner_txn["inner-txns"][
-                                        0
-                                    ]["payment-transaction"]["amount"]
-                                decimals = (
-                                    markets[market_app_id]
-                                    .lending_client.algofi_client.assets[
-                                        markets[market_app_id].underlying_asset_id
-                                    ]
-                                    .decimals
-                                )
-                                collateral_seized_amount /= 10 ** (decimals)
-                            else:
-                                print(app_args[0])
-                        else:
-                            asset_transfer_txn = liq_txn.get(
-                                "asset-transfer-transaction", {}
-                            )
-                            if asset_transfer_txn:
-                                repay_amount = asset_transfer_txn["amount"]
-                            else:
-                                repay_amount = liq_txn["payment-transaction"]["amount"]
-                    borrow_decimals = (
-                        markets[borrow_app_id]
-                        .lending_client.algofi_client.assets[
-                            markets[borrow_app_id].underlying_asset_id
-                        ]
-                        .decimals
-                    )
-                    repay_amount /= 10**borrow_decimals
-                    data_dict["Time"].append(timestamp)
-                    data_dict["Group"].append(gid)
-                    data_dict["Liquidator"].append(liquidator)
-                    data_dict["Liquidatee"].append(liquidatee)
-                    data_dict["Borrow Market"].append(borrow_market)
-                    data_dict["Collateral Market"].append(collateral_market)
-                    data_dict["Repay Amount"].append(repay_amount)
-                    data_dict["Collateral Seized"].append(collateral_seized_amount)
-                    data_dict["Profit [$]"].append(0.07 * repay_amount * borrow_price)
-                    groups_calced.append(gid)
+    snapshot = get_market_snapshot(algofi_client)
+    for event in events:
+        row = get_liquidation_event(snapshot, event)
+        for key in data_dict:
+            data_dict[key].append(row[key])
 
     df = pd.DataFrame(data_dict).sort_values(by="Time")
-    df.to_csv(args.csv_fpath + "v2-liquidation-events-%s.csv" % timestamp)
+    if args.incremental:
+        append_events(args.csv_fpath + "v2-liquidation-events.csv", df)
+        save_checkpoint(checkpoint_fpath, current_round)
+    else:
+        df.to_csv(args.csv_fpath + "v2-liquidation-events-%s.csv" % timestamp)
@@ -1,5 +1,4 @@
 # basic imports
-from base64 import b64decode, b64encode
 import pandas as pd
 import argparse
 from pytz import timezone
@@ -15,6 +14,12 @@ from algofi.v1.client import AlgofiMainnetClient
 from algofi.contract_strings import algofi_market_strings as market_strings
 from algofi.contract_strings import algofi_manager_strings as manager_strings
 
+from state_decoder import StateDecoder
+
+MARKET_STATE_DECODER = StateDecoder(
+    [market_strings.user_borrow_shares, market_strings.user_active_collateral]
+)
+
 
 def process_storage_account_data(
     algofi_client,
@@ -49,15 +54,10 @@ def process_storage_account_data(
                 0,
             )
             if "key-value" in app_data:
-                data = format_state_simple(app_data["key-value"])
+                data = MARKET_STATE_DECODER.decode(app_data["key-value"])
                 # get dollarized borrow
                 price = prices[app_data["id"]]
-                borrow_shares = data.get(
-                    b64encode(bytes(market_strings.user_borrow_shares, "utf-8")).decode(
-                        "utf-8"
-                    ),
-                    0,
-                )
+                borrow_shares = data.get(market_strings.user_borrow_shares, 0)
                 if borrow_shares:
                     borrow_token = (
                         (borrow_shares * underlying_borrowed_data[app_data["id"]])
@@ -68,10 +68,7 @@ def process_storage_account_data(
                     borrow += borrow_usd
                 # get dollarized max borrow
                 active_collateral_token = data.get(
-                    b64encode(
-                        bytes(market_strings.user_active_collateral, "utf-8")
-                    ).decode("utf-8"),
-                    0,
+                    market_strings.user_active_collateral, 0
                 )
                 if active_collateral_token:
                     exch_rate = exch_rates[app_data["id"]]
@@ -232,26 +229,6 @@ def scale_values(array, scalar):
     return [x * scalar for x in array]
 
 
-def format_state_simple(state):
-    """Returns state dict formatted to human-readable strings
-
-    :param state: dict of state returned by read_local_state or read_global_state
-    :type state: dict
-    :return: dict of state with keys + values formatted from bytes to utf-8 strings
-    :rtype: dict
-    """
-    formatted = {}
-    for item in state:
-        key = item["key"]
-        value = item["value"]
-        if value["type"] == 1:
-            formatted[key] = value["bytes"]
-        else:
-            # integer
-            formatted[key] = value["uint"]
-    return formatted
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Input processor")
     parser.add_argument(
@@ -4,6 +4,7 @@ import pandas as pd
 import argparse
 from pytz import timezone
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # algorand imports
 from algosdk.encoding import encode_address, decode_address
@@ -15,6 +16,20 @@ from algofipy.lending.v2.lending_config import MANAGER_STRINGS, MARKET_STRINGS
 from algofipy.algofi_client import AlgofiClient
 from algofipy.globals import Network
 
+from state_decoder import StateDecoder
+from health_engine import (
+    get_market_vectors,
+    decode_account,
+    build_health_book,
+    process_health_book,
+)
+
+MARKET_STATE_DECODER = StateDecoder(
+    [MARKET_STRINGS.user_borrow_shares, MARKET_STRINGS.user_active_b_asset_collateral]
+)
+MANAGER_STATE_DECODER = StateDecoder([MANAGER_STRINGS.user_account])
+MAX_SHARDS = 256
+
 # for scientific notation
 pd.set_option("display.float_format", lambda x: "%.2f" % x)
 
@@ -83,100 +98,183 @@ class AlgofiUserState:
             self.market_states[market_app_id].set_borrow(borrow)
 
 
-def get_liquidation_data(algofi_client):
-    # app id for the manager
-    manager_app_id = algofi_client.lending.manager_config.app_id
-    next_page = ""
-    user_states = []
+def get_user_state(algofi_client, account, manager_app_id):
     all_markets = algofi_client.lending.markets.keys()
-    while next_page is not None:
-        account_data = algofi_client.indexer.accounts(
+    user_state = AlgofiUserState(algofi_client)
+    # set storage address
+    user_state.set_storage_address(account["address"])
+    if "apps-local-state" not in account:
+        # this means the app has closed out of the protocol
+        return None
+    # all of the local states
+    local_states = account["apps-local-state"]
+    for state in local_states:
+        # case when they have state on a market
+        market_app_id = state["id"]
+        if market_app_id in all_markets:
+            # setting the market
+            market = algofi_client.lending.markets[state["id"]]
+            # initializing the user"s market state
+            user_state.initialize_user_market_state(market_app_id, market)
+            # increment market count
+            user_state.increment_market_count()
+            # checking for local state
+            if "key-value" in state:
+                data = MARKET_STATE_DECODER.decode(state["key-value"])
+                # get dollarized borrow
+                if MARKET_STRINGS.user_borrow_shares in data:
+                    borrow_shares = data[MARKET_STRINGS.user_borrow_shares]
+                    if market.borrow_share_circulation != 0:
+                        borrow_underlying = (
+                            borrow_shares * market.underlying_borrowed
+                        ) / market.borrow_share_circulation
+                        scaled_borrow_usd = market.underlying_to_usd(
+                            borrow_underlying
+                        ) * (market.borrow_factor / 1000)
+                        user_state.update_user_market_state(
+                            market_app_id=market_app_id,
+                            borrow=borrow_underlying,
+                        )
+                        user_state.increment_borrow(scaled_borrow_usd)
+                # get dollarized collateral
+                if MARKET_STRINGS.user_active_b_asset_collateral in data:
+                    collateral_b_asset_amount = data[
+                        MARKET_STRINGS.user_active_b_asset_collateral
+                    ]
+                    active_collateral_underlying = (
+                        collateral_b_asset_amount * market.get_underlying_supplied()
+                    ) / market.b_asset_circulation
+                    active_collateral_usd = market.underlying_to_usd(
+                        active_collateral_underlying
+                    )
+                    user_state.update_user_market_state(
+                        market_app_id=market_app_id,
+                        collateral=active_collateral_underlying,
+                    )
+                    user_state.increment_max_borrow(
+                        active_collateral_usd * (market.collateral_factor) / 1000
+                    )
+        if market_app_id == manager_app_id:
+            if "key-value" in state:
+                data = MANAGER_STATE_DECODER.decode(state["key-value"])
+                if MANAGER_STRINGS.user_account in data:
+                    unformatted_primary_address = data[MANAGER_STRINGS.user_account]
+                    # set the primary address
+                    user_state.set_primary_address(
+                        format_address_b32(unformatted_primary_address)
+                    )
+    # verify this is a real account
+    if user_state.market_count == 0:
+        return None
+    user_state.set_health_ratio()
+    return user_state
+
+
+def shard_count(value):
+    # argparse type of --n_shards
+    n_shards = int(value)
+    if not 1 <= n_shards <= MAX_SHARDS:
+        raise argparse.ArgumentTypeError("must be between 1 and %d" % MAX_SHARDS)
+    return n_shards
+
+
+def get_shard_bounds(n_shards):
+    """Splits the account address space into n_shards contiguous ranges
+
+    :param n_shards: number of shards, 1 to MAX_SHARDS
+    :type n_shards: int
+    :return: list of (start address to page after or "", raw address bytes the
+        shard stops at or None)
+    :rtype: list
+    """
+    # shards split on the first address byte
+    if not 1 <= n_shards <= MAX_SHARDS:
+        raise ValueError("n_shards must be between 1 and %d" % MAX_SHARDS)
+    bounds = [bytes([i * MAX_SHARDS // n_shards]) + bytes(31) for i in range(n_shards)]
+    starts = [""] + [encode_address(bound) for bound in bounds[1:]]
+    stops = bounds[1:] + [None]
+    return list(zip(starts, stops))
+
+
+def get_account_pages(indexer, manager_app_id, start_address="", stop_bytes=None):
+    """Yields pages of accounts opted into the manager. The next page is
+    requested before the current one is handed to the caller, so fetching
+    overlaps with parsing.
+    """
+
+    def fetch_page(next_page):
+        return indexer.accounts(
             limit=1000,
             next_page=next_page,
             application_id=manager_app_id,
             exclude="assets",
         )
-        # getting the new accounts to process
-        new_accounts_to_process = account_data["accounts"]
-        # iterating through the new accounts we received
-        for account in new_accounts_to_process:
-            user_state = AlgofiUserState(algofi_client)
-            # set storage address
-            user_state.set_storage_address(account["address"])
-            if "apps-local-state" not in account:
-                # this means the app has closed out of the protocol
-                continue
-            # all of the local states
-            local_states = account["apps-local-state"]
-            for state in local_states:
-                # case when they have state on a market
-                market_app_id = state["id"]
-                if market_app_id in all_markets:
-                    # setting the market
-                    market = algofi_client.lending.markets[state["id"]]
-                    # initializing the user"s market state
-                    user_state.initialize_user_market_state(market_app_id, market)
-                    # increment market count
-                    user_state.increment_market_count()
-                    # checking for local state
-                    if "key-value" in state:
-                        data = format_state_simple(state["key-value"])
-                        # get dollarized borrow
-                        if MARKET_STRINGS.user_borrow_shares in data:
-                            borrow_shares = data[MARKET_STRINGS.user_borrow_shares]
-                            if market.borrow_share_circulation != 0:
-                                borrow_underlying = (
-                                    borrow_shares * market.underlying_borrowed
-                                ) / market.borrow_share_circulation
-                                scaled_borrow_usd = market.underlying_to_usd(
-                                    borrow_underlying
-                                ) * (market.borrow_factor / 1000)
-                                user_state.update_user_market_state(
-                                    market_app_id=market_app_id,
-                                    borrow=borrow_underlying,
-                                )
-                                user_state.increment_borrow(scaled_borrow_usd)
-                        # get dollarized collateral
-                        if MARKET_STRINGS.user_active_b_asset_collateral in data:
-                            collateral_b_asset_amount = data[
-                                MARKET_STRINGS.user_active_b_asset_collateral
-                            ]
-                            active_collateral_underlying = (
-                                collateral_b_asset_amount
-                                * market.get_underlying_supplied()
-                            ) / market.b_asset_circulation
-                            active_collateral_usd = market.underlying_to_usd(
-                                active_collateral_underlying
-                            )
-                            user_state.update_user_market_state(
-                                market_app_id=market_app_id,
-                                collateral=active_collateral_underlying,
-                            )
-                            user_state.increment_max_borrow(
-                                active_collateral_usd
-                                * (market.collateral_factor)
-                                / 1000
-                            )
-                if market_app_id == manager_app_id:
-                    if "key-value" in state:
-                        data = format_state_simple(state["key-value"])
-                        if MANAGER_STRINGS.user_account in data:
-                            unformatted_primary_address = data[
-                                MANAGER_STRINGS.user_account
-                            ]
-                            # set the primary address
-                            user_state.set_primary_address(
-                                format_address_b32(unformatted_primary_address)
-                            )
-            # verify this is a real account
-            if user_state.market_count > 0:
-                user_state.set_health_ratio()
-                user_states.append(user_state)
-        if "next-token" in account_data:
-            next_page = account_data["next-token"]
-        else:
-            next_page = None
-    return user_states
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(fetch_page, start_address)
+        while future is not None:
+            account_data = future.result()
+            accounts = account_data["accounts"]
+            next_page = account_data.get("next-token", None)
+            # stop at the start of the next shard
+            if stop_bytes is not None and accounts:
+                if decode_address(accounts[-1]["address"]) >= stop_bytes:
+                    next_page = None
+                    accounts = [
+                        account
+                        for account in accounts
+                        if decode_address(account["address"]) < stop_bytes
+                    ]
+            future = executor.submit(fetch_page, next_page) if next_page else None
+            yield accounts
+
+
+def scan_accounts(algofi_client, parse_account, indexers=None, n_shards=1):
+    """Applies parse_account to every storage account and returns the results
+    which are not None. The address space is scanned in n_shards shards
+    concurrently, spread round robin over indexers.
+    """
+    # app id for the manager
+    manager_app_id = algofi_client.lending.manager_config.app_id
+    if not indexers:
+        indexers = [algofi_client.indexer]
+
+    def scan_shard(shard):
+        i, (start_address, stop_bytes) = shard
+        parsed = []
+        for accounts in get_account_pages(
+            indexers[i % len(indexers)], manager_app_id, start_address, stop_bytes
+        ):
+            for account in accounts:
+                result = parse_account(account)
+                if result is not None:
+                    parsed.append(result)
+        return parsed
+
+    with ThreadPoolExecutor(max_workers=n_shards) as executor:
+        results = executor.map(scan_shard, enumerate(get_shard_bounds(n_shards)))
+        return [result for parsed in results for result in parsed]
+
+
+def get_liquidation_data(algofi_client, indexers=None, n_shards=1):
+    manager_app_id = algofi_client.lending.manager_config.app_id
+    return scan_accounts(
+        algofi_client,
+        lambda account: get_user_state(algofi_client, account, manager_app_id),
+        indexers=indexers,
+        n_shards=n_shards,
+    )
+
+
+def get_health_book(algofi_client, vectors, indexers=None, n_shards=1):
+    manager_app_id = algofi_client.lending.manager_config.app_id
+    decoded_accounts = scan_accounts(
+        algofi_client,
+        lambda account: decode_account(account, vectors.index, manager_app_id),
+        indexers=indexers,
+        n_shards=n_shards,
+    )
+    return build_health_book(decoded_accounts, len(vectors.app_ids))
 
 
 # convert txns_processed to a reasonable csv for testing the liquidation bot script
@@ -252,18 +350,6 @@ def get_time(tz="EST"):
     return ts
 
 
-def format_state_simple(state):
-    formatted = {}
-    for item in state:
-        key = item["key"]
-        value = item["value"]
-        if value["type"] == 1:
-            formatted[b64decode(key).decode("utf-8")] = value["bytes"]
-        else:
-            formatted[b64decode(key).decode("utf-8")] = value["uint"]
-    return formatted
-
-
 # formatting an address from on chain
 def format_address_b32(address):
     bytes_ver = bytes(address, "utf-8")
@@ -289,6 +375,11 @@ if __name__ == "__main__":
     parser.add_argument("--health_ratio_threshold", type=float, default=0.85)
     parser.add_argument("--borrow_threshold", type=float, default=1.0)
     parser.add_argument("--csv_fpath", type=str, required=True)
+    parser.add_argument("--extra_indexer_uris", type=str, default="")
+    parser.add_argument("--n_shards", type=shard_count, default=1)
+    parser.add_argument(
+        "--engine", type=str, choices=["numpy", "python"], default="numpy"
+    )
 
     args = parser.parse_args()
 
@@ -300,16 +391,39 @@ if __name__ == "__main__":
     indexer_client = IndexerClient(args.indexer_token, args.indexer_uri)
     algofi_client = AlgofiClient(Network.MAINNET, algod_client, indexer_client)
 
-    # get the liquidation data from state for crosscheck
-    liquidation_data = get_liquidation_data(algofi_client)
+    # shards of the account scan are spread over every indexer
+    indexers = [indexer_client] + [
+        IndexerClient(args.indexer_token, uri)
+        for uri in args.extra_indexer_uris.split(",")
+        if uri
+    ]
+
+    if args.engine == "numpy":
+        # dense user x market arrays, evaluated with array ops
+        vectors = get_market_vectors(algofi_client)
+        book = get_health_book(
+            algofi_client, vectors, indexers=indexers, n_shards=args.n_shards
+        )
+        (summary_df, drilldown_df) = process_health_book(
+            timestamp,
+            book,
+            vectors,
+            health_ratio_threshold=float(args.health_ratio_threshold),
+            dollarized_borrow_threshold=float(args.borrow_threshold),
+        )
+    else:
+        # get the liquidation data from state for crosscheck
+        liquidation_data = get_liquidation_data(
+            algofi_client, indexers=indexers, n_shards=args.n_shards
+        )
 
-    # generate liquidation csvs
-    (summary_df, drilldown_df) = process_liquidation_data(
-        timestamp=timestamp,
-        liquidate_data=liquidation_data,
-        health_ratio_threshold=float(args.health_ratio_threshold),
-        dollarized_borrow_threshold=float(args.borrow_threshold),
-    )
+        # generate liquidation csvs
+        (summary_df, drilldown_df) = process_liquidation_data(
+            timestamp=timestamp,
+            liquidate_data=liquidation_data,
+            health_ratio_threshold=float(args.health_ratio_threshold),
+            dollarized_borrow_threshold=float(args.borrow_threshold),
+        )
 
     summary_df.to_csv(args.csv_fpath + "v2-liquidation-summary-%s.csv" % timestamp)
     drilldown_df.to_csv(args.csv_fpath + "v2-liquidation-drilldown-%s.csv" % timestamp)
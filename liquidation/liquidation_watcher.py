@@ -0,0 +1,338 @@
+# basic imports
+import argparse
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, monotonic
+import numpy as np
+
+# algorand imports
+from algosdk.v2client.algod import AlgodClient
+from algosdk.v2client.indexer import IndexerClient
+
+# algofi imports
+from algofipy.algofi_client import AlgofiClient
+from algofipy.globals import Network
+
+from indexer_cache import search_all_transactions
+from health_engine import (
+    HealthBook,
+    get_market_vectors,
+    compute_health,
+    decode_account,
+)
+from liquidation_report_v2 import get_health_book, get_time, shard_count
+
+# seconds to wait for the indexer to reach algod before a step is retried
+MAX_INDEXER_WAIT = 20
+N_THREADS = 8
+
+
+def vectors_changed(old, new):
+    return (
+        old.app_ids != new.app_ids
+        or not np.array_equal(old.borrow_share_rate, new.borrow_share_rate)
+        or not np.array_equal(old.b_asset_rate, new.b_asset_rate)
+        or not np.array_equal(old.usd_price, new.usd_price)
+        or not np.array_equal(old.borrow_factor, new.borrow_factor)
+        or not np.array_equal(old.collateral_factor, new.collateral_factor)
+    )
+
+
+class LiquidationWatcher:
+    """Keeps the health of every V2 storage account in memory and follows new
+    blocks. Accounts touched by market or manager calls are refetched from algod
+    and only their rows are recomputed. Markets are reloaded when they or their
+    oracle are called, and all rows are recomputed only when a market rate or
+    price actually changed. Accounts are kept in a max heap by health ratio.
+    """
+
+    def __init__(
+        self,
+        algofi_client,
+        health_ratio_threshold,
+        borrow_threshold,
+        indexers=None,
+        n_shards=1,
+    ):
+        self.algofi_client = algofi_client
+        self.algod = algofi_client.algod
+        self.indexer = algofi_client.indexer
+        self.health_ratio_threshold = health_ratio_threshold
+        self.borrow_threshold = borrow_threshold
+        self.indexers = indexers
+        self.n_shards = n_shards
+        self.manager_app_id = algofi_client.lending.manager_config.app_id
+        self.oracle_to_markets = {}
+        for market_app_id, market in algofi_client.lending.markets.items():
+            self.oracle_to_markets.setdefault(market.oracle.app_id, []).append(
+                market_app_id
+            )
+        self.executor = ThreadPoolExecutor(max_workers=N_THREADS)
+        self.at_risk = set()
+
+    def load(self):
+        # rounds after this one are applied on top of the full scan. The scan
+        # reads the indexer, so the round is the one every scanned indexer has
+        # reached, or a page could miss changes step never replays
+        self.round = min(
+            indexer.health()["round"] for indexer in self.indexers or [self.indexer]
+        )
+        self.vectors = get_market_vectors(self.algofi_client)
+        self.book = get_health_book(
+            self.algofi_client,
+            self.vectors,
+            indexers=self.indexers,
+            n_shards=self.n_shards,
+        )
+        self.rows = {
+            address: row for row, address in enumerate(self.book.storage_addresses)
+        }
+        self.recompute_all()
+        print(
+            "%s: loaded %d storage accounts at round %d"
+            % (get_time(), len(self.rows), self.round)
+        )
+
+    def recompute_all(self):
+        health = compute_health(self.book, self.vectors)
+        self.borrow = health["borrow"]
+        self.health_ratio = health["health_ratio"]
+        self.heap = [(-ratio, row) for row, ratio in enumerate(self.health_ratio)]
+        heapq.heapify(self.heap)
+
+    def recompute_rows(self, rows):
+        health = compute_health(
+            HealthBook(
+                None, None, self.book.borrow_shares[rows], self.book.collateral[rows]
+            ),
+            self.vectors,
+        )
+        self.borrow[rows] = health["borrow"]
+        self.health_ratio[rows] = health["health_ratio"]
+        for row, ratio in zip(rows, health["health_ratio"]):
+            heapq.heappush(self.heap, (-ratio, row))
+        # drop stale entries once they outnumber the live ones
+        if len(self.heap) > 2 * len(self.health_ratio):
+            self.heap = [(-ratio, row) for row, ratio in enumerate(self.health_ratio)]
+            heapq.heapify(self.heap)
+
+    def get_at_risk(self):
+        """Returns the rows at or above the health ratio threshold, riskiest
+        first, popping stale heap entries on the way
+        """
+        rows = []
+        seen = set()
+        while self.heap:
+            ratio, row = self.heap[0]
+            if -ratio != self.health_ratio[row] or row in seen:
+                heapq.heappop(self.heap)
+                continue
+            if -ratio < self.health_ratio_threshold:
+                break
+            rows.append(heapq.heappop(self.heap))
+            seen.add(row)
+        for entry in rows:
+            heapq.heappush(self.heap, entry)
+        return [row for (_, row) in rows if self.borrow[row] >= self.borrow_threshold]
+
+    def get_touched(self, txns):
+        # market app ids to reload and storage accounts to refetch
+        market_app_ids = set()
+        addresses = set()
+        for txn in txns:
+            app_txn = txn.get("application-transaction", {})
+            app_id = app_txn.get("application-id", None)
+            if app_id in self.oracle_to_markets:
+                market_app_ids.update(self.oracle_to_markets[app_id])
+            if app_id in self.vectors.index or app_id == self.manager_app_id:
+                if app_id in self.vectors.index:
+                    market_app_ids.add(app_id)
+                addresses.add(txn["sender"])
+                addresses.update(app_txn.get("accounts", []))
+        return market_app_ids, addresses
+
+    def reload_markets(self, market_app_ids):
+        markets = self.algofi_client.lending.markets
+        list(
+            self.executor.map(
+                lambda market_app_id: markets[market_app_id].load_state(),
+                market_app_ids,
+            )
+        )
+        vectors = get_market_vectors(self.algofi_client)
+        changed = vectors_changed(self.vectors, vectors)
+        self.vectors = vectors
+        return changed
+
+    def refresh_accounts(self, addresses):
+        # algod has the state as of the latest round, the indexer may lag
+        accounts = self.executor.map(self.algod.account_info, addresses)
+        rows = []
+        for address, account in zip(addresses, accounts):
+            decoded = decode_account(account, self.vectors.index, self.manager_app_id)
+            if decoded is None:
+                if address not in self.rows:
+                    # not a storage account
+                    continue
+                borrow_shares = collateral = 0
+            else:
+                borrow_shares = np.zeros(len(self.vectors.app_ids))
+                collateral = np.zeros(len(self.vectors.app_ids))
+                for col, borrow_share_amount, b_asset_amount in decoded[2]:
+                    borrow_shares[col] = borrow_share_amount
+                    collateral[col] = b_asset_amount
+            if address not in self.rows:
+                self.add_row(address, decoded[1])
+            row = self.rows[address]
+            self.book.borrow_shares[row] = borrow_shares
+            self.book.collateral[row] = collateral
+            rows.append(row)
+        return rows
+
+    def add_row(self, address, primary_address):
+        n_markets = len(self.vectors.app_ids)
+        self.rows[address] = len(self.book.storage_addresses)
+        self.book.storage_addresses.append(address)
+        self.book.primary_addresses.append(primary_address)
+        self.book.borrow_shares = np.vstack(
+            [self.book.borrow_shares, np.zeros((1, n_markets))]
+        )
+        self.book.collateral = np.vstack(
+            [self.book.collateral, np.zeros((1, n_markets))]
+        )
+        self.borrow = np.append(self.borrow, 0.0)
+        self.health_ratio = np.append(self.health_ratio, 0.0)
+
+    def get_watched_app_ids(self):
+        # calls to these apps can change a market or a storage account
+        return (
+            list(self.vectors.index)
+            + [self.manager_app_id]
+            + list(self.oracle_to_markets)
+        )
+
+    def get_round_txns(self, min_round, max_round):
+        # wait for the indexer to catch up with algod, a search of rounds it has
+        # not reached yet would miss their transactions for good
+        indexer_round = self.indexer.health()["round"]
+        for _ in range(MAX_INDEXER_WAIT):
+            if indexer_round >= max_round:
+                break
+            sleep(1)
+            indexer_round = self.indexer.health()["round"]
+        if indexer_round < max_round:
+            raise RuntimeError(
+                "indexer at round %d, behind algod at round %d"
+                % (indexer_round, max_round)
+            )
+        results = self.executor.map(
+            lambda app_id: search_all_transactions(
+                self.indexer.search_transactions,
+                min_round,
+                max_round,
+                application_id=app_id,
+            ),
+            self.get_watched_app_ids(),
+        )
+        # a transaction calling several watched apps is returned once per app
+        txns = {}
+        for app_txns in results:
+            for txn in app_txns:
+                txns[txn["id"]] = txn
+        return list(txns.values())
+
+    def step(self):
+        """Waits for the next block and applies every round since the last step
+
+        :return: list of rows which became liquidatable during the step
+        :rtype: list
+        """
+        status = self.algod.status_after_block(self.round)
+        last_round = status["last-round"]
+        start = monotonic()
+        txns = self.get_round_txns(self.round + 1, last_round)
+        market_app_ids, addresses = self.get_touched(txns)
+        rows = self.refresh_accounts(list(addresses))
+        if market_app_ids and self.reload_markets(market_app_ids):
+            self.recompute_all()
+        elif rows:
+            self.recompute_rows(rows)
+        self.round = last_round
+
+        at_risk = set(self.get_at_risk())
+        new_at_risk = at_risk - self.at_risk
+        self.at_risk = at_risk
+        print(
+            "%s: round %d, %d txns, %d accounts refreshed, %d markets reloaded, "
+            "%d at risk, %.2fs"
+            % (
+                get_time(),
+                last_round,
+                len(txns),
+                len(rows),
+                len(market_app_ids),
+                len(at_risk),
+                monotonic() - start,
+            )
+        )
+        return list(new_at_risk)
+
+    def run(self):
+        self.load()
+        while True:
+            try:
+                new_at_risk = self.step()
+            except Exception as e:
+                # the next step picks up from the last applied round
+                print(e)
+                sleep(1)
+                continue
+            for row in sorted(new_at_risk, key=lambda row: -self.health_ratio[row]):
+                print(
+                    "at risk: %s (primary %s), health ratio %.3f, borrow %.2f"
+                    % (
+                        self.book.storage_addresses[row],
+                        self.book.primary_addresses[row],
+                        self.health_ratio[row],
+                        self.borrow[row],
+                    )
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Input processor")
+    parser.add_argument(
+        "--algod_uri", type=str, default="https://node.algoexplorerapi.io"
+    )
+    parser.add_argument("--algod_token", type=str, default="")
+    parser.add_argument(
+        "--indexer_uri", type=str, default="https://algoindexer.algoexplorerapi.io"
+    )
+    parser.add_argument("--indexer_token", type=str, default="")
+    parser.add_argument("--health_ratio_threshold", type=float, default=0.85)
+    parser.add_argument("--borrow_threshold", type=float, default=1.0)
+    parser.add_argument("--extra_indexer_uris", type=str, default="")
+    parser.add_argument("--n_shards", type=shard_count, default=1)
+
+    args = parser.parse_args()
+
+    # initialize clients
+    algod_client = AlgodClient(args.algod_token, args.algod_uri)
+    indexer_client = IndexerClient(args.indexer_token, args.indexer_uri)
+    algofi_client = AlgofiClient(Network.MAINNET, algod_client, indexer_client)
+
+    # the initial scan is spread over every indexer
+    indexers = [indexer_client] + [
+        IndexerClient(args.indexer_token, uri)
+        for uri in args.extra_indexer_uris.split(",")
+        if uri
+    ]
+
+    watcher = LiquidationWatcher(
+        algofi_client,
+        args.health_ratio_threshold,
+        args.borrow_threshold,
+        indexers=indexers,
+        n_shards=args.n_shards,
+    )
+    watcher.run()
@@ -0,0 +1,198 @@
+# basic imports
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+# algorand imports
+from algosdk.v2client.algod import AlgodClient
+from algosdk.v2client.indexer import IndexerClient
+
+# algofi imports
+from algofipy.algofi_client import AlgofiClient
+from algofipy.globals import Network
+
+from health_engine import (
+    get_market_vectors,
+    compute_health,
+    save_health_book,
+    load_health_book,
+)
+from liquidation_report_v2 import get_health_book, get_time, shard_count
+
+DEFAULT_CLOSE_FACTOR = 0.5
+DEFAULT_LIQUIDATION_INCENTIVE = 0.07
+# markets which share their underlying asset with another market
+DUPLICATE_ASSET_MARKETS = ["vALGO"]
+# asset id the sdk uses for ALGO balances
+ALGO_ASSET_ID = 1
+# microALGO kept back from ALGO repays for transaction fees
+DEFAULT_ALGO_RESERVE = 1000000
+
+
+def get_balance_vector(
+    algofi_client, vectors, balances, algo_reserve=DEFAULT_ALGO_RESERVE
+):
+    """Returns the liquidator balance of each market underlying in base units,
+    0 for markets which can not be repaid from the balance
+
+    :param balances: dict of asset id to balance, as in user.balances
+    :type balances: dict
+    :param algo_reserve: microALGO not used for repays, to pay fees and keep
+        the minimum balance
+    :type algo_reserve: int
+    """
+    markets = algofi_client.lending.markets
+    balances = dict(balances)
+    balances[ALGO_ASSET_ID] = max(0, balances.get(ALGO_ASSET_ID, 0) - algo_reserve)
+    return np.array(
+        [
+            0
+            if markets[app_id].name in DUPLICATE_ASSET_MARKETS
+            else balances.get(markets[app_id].underlying_asset_id, 0)
+            for app_id in vectors.app_ids
+        ],
+        dtype=np.float64,
+    )
+
+
+def rank_opportunities(
+    book,
+    vectors,
+    balances,
+    close_factor=DEFAULT_CLOSE_FACTOR,
+    liquidation_incentive=DEFAULT_LIQUIDATION_INCENTIVE,
+    health_ratio_threshold=1.0,
+):
+    """Returns the best (repay market, seize market, amount) of every
+    liquidatable account, sorted by expected profit
+
+    A repay of x usd is capped by close_factor of the borrow and by the
+    liquidator balance in the repay market, and must leave x * (1 + incentive)
+    of collateral to seize. The profit x * incentive grows with x, and the best
+    min(repay cap, seize cap) over all pairs is the min of the best repay cap
+    and the best seize cap, so each account needs two argmaxes. Accounts are
+    ranked independently, one liquidation may use the balance another needs.
+
+    :param balances: liquidator balance per market in base units, see
+        get_balance_vector
+    :type balances: :class:`np.ndarray`
+    :return: one row per account with a profitable liquidation
+    :rtype: :class:`pd.DataFrame`
+    """
+    health = compute_health(book, vectors)
+    users = np.flatnonzero(
+        (health["health_ratio"] >= health_ratio_threshold) & (health["max_borrow"] != 0)
+    )
+    borrow_usd = health["borrow_usd"][users]
+    collateral_usd = health["collateral_usd"][users]
+
+    repay_caps = np.minimum(close_factor * borrow_usd, balances * vectors.usd_price)
+    seize_caps = collateral_usd / (1 + liquidation_incentive)
+    repay_cols = repay_caps.argmax(axis=1)
+    seize_cols = seize_caps.argmax(axis=1)
+    rows = np.arange(len(users))
+    repay_usd = np.minimum(repay_caps[rows, repay_cols], seize_caps[rows, seize_cols])
+
+    # whole base units of the repay asset
+    repay_prices = vectors.usd_price[repay_cols]
+    repay_amount = np.floor(
+        np.divide(
+            repay_usd,
+            repay_prices,
+            out=np.zeros_like(repay_usd),
+            where=repay_prices > 0,
+        )
+    )
+    repay_usd = repay_amount * repay_prices
+    profitable = repay_amount > 0
+
+    names = np.array(vectors.names, dtype=object)
+    storage_addresses = np.array(book.storage_addresses, dtype=object)
+    primary_addresses = np.array(book.primary_addresses, dtype=object)
+    return (
+        pd.DataFrame(
+            {
+                "Storage Account": storage_addresses[users],
+                "Primary Account": primary_addresses[users],
+                "Health Ratio": health["health_ratio"][users],
+                "Repay Symbol": names[repay_cols],
+                "Seize Symbol": names[seize_cols],
+                "Repay Amount": repay_amount.astype(np.int64),
+                "Repay (USD)": repay_usd,
+                "Seize (USD)": repay_usd * (1 + liquidation_incentive),
+                "Expected Profit (USD)": repay_usd * liquidation_incentive,
+            }
+        )[profitable]
+        .sort_values("Expected Profit (USD)", ascending=False)
+        .reset_index(drop=True)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Input processor")
+    parser.add_argument(
+        "--algod_uri", type=str, default="https://node.algoexplorerapi.io"
+    )
+    parser.add_argument("--algod_token", type=str, default="")
+    parser.add_argument(
+        "--indexer_uri", type=str, default="https://algoindexer.algoexplorerapi.io"
+    )
+    parser.add_argument("--indexer_token", type=str, default="")
+    parser.add_argument("--liquidator_address", type=str, required=True)
+    parser.add_argument("--close_factor", type=float, default=DEFAULT_CLOSE_FACTOR)
+    parser.add_argument(
+        "--liquidation_incentive", type=float, default=DEFAULT_LIQUIDATION_INCENTIVE
+    )
+    parser.add_argument("--health_ratio_threshold", type=float, default=1.0)
+    parser.add_argument("--min_profit", type=float, default=0.0)
+    parser.add_argument("--algo_reserve", type=int, default=DEFAULT_ALGO_RESERVE)
+    parser.add_argument("--book_fpath", type=str, default="")
+    parser.add_argument("--n_shards", type=shard_count, default=1)
+    parser.add_argument("--csv_fpath", type=str, required=True)
+
+    args = parser.parse_args()
+
+    # get time
+    timestamp = get_time()
+
+    # initialize clients
+    algod_client = AlgodClient(args.algod_token, args.algod_uri)
+    indexer_client = IndexerClient(args.indexer_token, args.indexer_uri)
+    algofi_client = AlgofiClient(Network.MAINNET, algod_client, indexer_client)
+
+    # a saved book is reused for its positions, prices are always current
+    vectors = get_market_vectors(algofi_client)
+    if args.book_fpath and os.path.exists(args.book_fpath):
+        book, saved_vectors = load_health_book(args.book_fpath)
+        if saved_vectors.app_ids != vectors.app_ids:
+            raise ValueError(
+                "%s was saved for markets %s, the protocol now has %s"
+                % (args.book_fpath, saved_vectors.app_ids, vectors.app_ids)
+            )
+    else:
+        book = get_health_book(algofi_client, vectors, n_shards=args.n_shards)
+        if args.book_fpath:
+            save_health_book(args.book_fpath, book, vectors)
+
+    liquidator_user = algofi_client.get_user(args.liquidator_address)
+    balances = get_balance_vector(
+        algofi_client, vectors, liquidator_user.balances, args.algo_reserve
+    )
+
+    opportunities = rank_opportunities(
+        book,
+        vectors,
+        balances,
+        close_factor=args.close_factor,
+        liquidation_incentive=args.liquidation_incentive,
+        health_ratio_threshold=args.health_ratio_threshold,
+    )
+    opportunities = opportunities[
+        opportunities["Expected Profit (USD)"] >= args.min_profit
+    ]
+    print(opportunities.head(20))
+    opportunities["Timestamp"] = timestamp
+    opportunities.to_csv(
+        args.csv_fpath + "v2-liquidation-opportunities-%s.csv" % timestamp
+    )
@@ -0,0 +1,114 @@
+# the liquidation/ and threaded/ copies of this module are kept identical
+# basic imports
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+MAX_ATTEMPTS = 5
+
+
+class HistoricalPriceCache:
+    """Memoized V1 market prices and bank to underlying exchange rates per
+    (market, round). Lookups for a whole window are deduped and fetched
+    concurrently by prefetch, spread over the given clients, and can be
+    persisted to a json file across runs.
+    """
+
+    def __init__(self, algofi_clients, fpath="", n_threads=8):
+        self.algofi_clients = algofi_clients
+        self.fpath = fpath
+        self.n_threads = n_threads
+        self.prices = {}
+        self.exchange_rates = {}
+        if fpath and os.path.exists(fpath):
+            with open(fpath, "r") as f:
+                data = json.load(f)
+            self.prices = data["prices"]
+            self.exchange_rates = data["exchange_rates"]
+
+    def get_key(self, market_name, round_):
+        # json object keys have to be strings
+        return "%s:%d" % (market_name, round_)
+
+    def read_price(self, algofi_client, market_name, round_):
+        return algofi_client.markets[market_name].asset.get_price(block=round_)
+
+    def read_exchange_rate(self, algofi_client, market_name, round_):
+        return algofi_client.markets[market_name].get_bank_to_underlying_exchange(
+            block=round_
+        )
+
+    def read_with_retry(self, read_func, i, market_name, round_):
+        # round robin the reads over the clients
+        algofi_client = self.algofi_clients[i % len(self.algofi_clients)]
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                return read_func(algofi_client, market_name, round_)
+            except Exception as e:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                print(e)
+                sleep(2**attempt)
+
+    def fetch_missing(self, values, read_func, lookups):
+        missing = list(
+            {
+                self.get_key(market_name, round_): (market_name, round_)
+                for (market_name, round_) in lookups
+                if self.get_key(market_name, round_) not in values
+            }.items()
+        )
+        if not missing:
+            return
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            results = executor.map(
+                lambda i: self.read_with_retry(read_func, i, *missing[i][1]),
+                range(len(missing)),
+            )
+            for (key, _), value in zip(missing, results):
+                values[key] = value
+
+    def prefetch(self, price_lookups, exchange_rate_lookups):
+        """Fetches every lookup of a window which is not cached yet
+
+        :param price_lookups: list of (market name, round) tuples
+        :type price_lookups: list
+        :param exchange_rate_lookups: list of (market name, round) tuples
+        :type exchange_rate_lookups: list
+        """
+        self.fetch_missing(self.prices, self.read_price, price_lookups)
+        self.fetch_missing(
+            self.exchange_rates, self.read_exchange_rate, exchange_rate_lookups
+        )
+
+    def get_price(self, market_name, round_):
+        self.fetch_missing(self.prices, self.read_price, [(market_name, round_)])
+        return self.prices[self.get_key(market_name, round_)]
+
+    def get_exchange_rate(self, market_name, round_):
+        self.fetch_missing(
+            self.exchange_rates, self.read_exchange_rate, [(market_name, round_)]
+        )
+        return self.exchange_rates[self.get_key(market_name, round_)]
+
+    def save(self):
+        if not self.fpath:
+            return
+        tmp_fpath = self.fpath + ".tmp"
+        with open(tmp_fpath, "w") as f:
+            json.dump({"prices": self.prices, "exchange_rates": self.exchange_rates}, f)
+        os.replace(tmp_fpath, self.fpath)
+
+
+def get_price_lookups(market_id_to_name, events):
+    # (market, round) reads needed to price the events
+    price_lookups = [
+        (market_id_to_name[event["borrow_app_id"]], event["round"]) for event in events
+    ]
+    exchange_rate_lookups = [
+        (market_id_to_name[event["collateral_app_id"]], event["round"])
+        for event in events
+        if event["collateral_is_bank_asset"]
+    ]
+    return price_lookups, exchange_rate_lookups
@@ -0,0 +1,133 @@
+# basic imports
+import argparse
+import os
+from itertools import product
+import numpy as np
+import pandas as pd
+
+# algorand imports
+from algosdk.v2client.algod import AlgodClient
+from algosdk.v2client.indexer import IndexerClient
+
+# algofi imports
+from algofipy.algofi_client import AlgofiClient
+from algofipy.globals import Network
+
+from health_engine import get_market_vectors, save_health_book, load_health_book
+from liquidation_report_v2 import get_health_book, get_time, shard_count
+
+# scenarios evaluated per matrix product, bounds memory to users x batch floats
+SCENARIO_BATCH = 64
+
+
+def parse_shock_values(spec):
+    # "lo:hi:step" range of shocks, or ";" delimited shocks
+    if ":" in spec:
+        lo, hi, step = map(float, spec.split(":"))
+        return list(np.round(np.arange(lo, hi + step / 2, step), 6))
+    return [float(value) for value in spec.split(";")]
+
+
+def get_shock_grid(names, shocks):
+    """Returns every combination of the given per market price shocks
+
+    :param names: market names in vector order
+    :type names: list
+    :param shocks: comma-delimited NAME=SHOCK;SHOCK or NAME=LO:HI:STEP, e.g.
+        "ALGO=-0.3:0:0.05,USDC=0", where -0.15 is a 15% price drop. Markets
+        which are not listed keep their price.
+    :type shocks: str
+    :return: (n_scenarios x n_markets) array of relative price shocks
+    :rtype: :class:`np.ndarray`
+    """
+    market_shocks = {}
+    for item in shocks.split(","):
+        if not item:
+            continue
+        name, spec = item.split("=")
+        if name not in names:
+            raise ValueError("unknown market %s, markets are %s" % (name, names))
+        market_shocks[names.index(name)] = parse_shock_values(spec)
+    cols = list(market_shocks.keys())
+    combos = list(product(*[market_shocks[col] for col in cols]))
+    grid = np.zeros((len(combos), len(names)))
+    if cols:
+        grid[:, cols] = np.array(combos)
+    return grid
+
+
+def simulate(book, vectors, grid, health_ratio_threshold, borrow_threshold):
+    """Evaluates every scenario of the grid in batched matrix products. Prices
+    scale linearly, so per scenario usd amounts are the base amounts times the
+    shocked price multipliers.
+    """
+    borrow_usd = book.borrow_shares * (vectors.borrow_share_rate * vectors.usd_price)
+    collateral_usd = book.collateral * (vectors.b_asset_rate * vectors.usd_price)
+    scaled_borrow_usd = borrow_usd * vectors.borrow_factor
+    max_borrow_usd = collateral_usd * vectors.collateral_factor
+    multipliers = 1 + grid
+
+    counts, borrow_at_risk, collateral_at_risk = [], [], []
+    for start in range(0, len(grid), SCENARIO_BATCH):
+        batch = multipliers[start : start + SCENARIO_BATCH].T
+        borrow = scaled_borrow_usd @ batch
+        max_borrow = max_borrow_usd @ batch
+        at_risk = (
+            (borrow >= max_borrow * health_ratio_threshold)
+            & (borrow >= borrow_threshold)
+            & (borrow != 0)
+            & (max_borrow != 0)
+        )
+        counts.append(at_risk.sum(axis=0))
+        borrow_at_risk.append(((borrow_usd @ batch) * at_risk).sum(axis=0))
+        collateral_at_risk.append(((collateral_usd @ batch) * at_risk).sum(axis=0))
+
+    results = pd.DataFrame(grid, columns=["%s Shock" % name for name in vectors.names])
+    results["Liquidatable Accounts"] = np.concatenate(counts)
+    results["Borrow At Risk (USD)"] = np.concatenate(borrow_at_risk)
+    results["Collateral At Risk (USD)"] = np.concatenate(collateral_at_risk)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Input processor")
+    parser.add_argument(
+        "--algod_uri", type=str, default="https://node.algoexplorerapi.io"
+    )
+    parser.add_argument("--algod_token", type=str, default="")
+    parser.add_argument(
+        "--indexer_uri", type=str, default="https://algoindexer.algoexplorerapi.io"
+    )
+    parser.add_argument("--indexer_token", type=str, default="")
+    parser.add_argument("--health_ratio_threshold", type=float, default=1.0)
+    parser.add_argument("--borrow_threshold", type=float, default=1.0)
+    parser.add_argument("--shocks", type=str, required=True)
+    parser.add_argument("--book_fpath", type=str, default="")
+    parser.add_argument("--refresh", action="store_true")
+    parser.add_argument("--n_shards", type=shard_count, default=1)
+    parser.add_argument("--csv_fpath", type=str, required=True)
+
+    args = parser.parse_args()
+
+    # get time
+    timestamp = get_time()
+
+    if args.book_fpath and os.path.exists(args.book_fpath) and not args.refresh:
+        book, vectors = load_health_book(args.book_fpath)
+    else:
+        # initialize clients
+        algod_client = AlgodClient(args.algod_token, args.algod_uri)
+        indexer_client = IndexerClient(args.indexer_token, args.indexer_uri)
+        algofi_client = AlgofiClient(Network.MAINNET, algod_client, indexer_client)
+
+        vectors = get_market_vectors(algofi_client)
+        book = get_health_book(algofi_client, vectors, n_shards=args.n_shards)
+        if args.book_fpath:
+            save_health_book(args.book_fpath, book, vectors)
+
+    grid = get_shock_grid(vectors.names, args.shocks)
+    results = simulate(
+        book, vectors, grid, args.health_ratio_threshold, args.borrow_threshold
+    )
+    results["Timestamp"] = timestamp
+    results.to_csv(args.csv_fpath + "v2-price-shock-%s.csv" % timestamp)
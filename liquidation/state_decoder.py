@@ -0,0 +1,37 @@
+# basic imports
+from base64 import b64encode
+
+
+def get_state_key(name):
+    # state keys as the indexer returns them
+    return b64encode(bytes(name, "utf-8")).decode("utf-8")
+
+
+class StateDecoder:
+    """Decodes the few state keys a script reads. Key names are base64 encoded
+    once, raw indexer keys are matched against them directly and every other
+    key is skipped without decoding.
+    """
+
+    def __init__(self, names):
+        self.keys = {get_state_key(name): name for name in names}
+
+    def decode(self, state):
+        """Returns the wanted keys of a state
+
+        :param state: list of key-value entries of a local or global state
+        :type state: list
+        :return: dict of key name to uint or base64 bytes value
+        :rtype: dict
+        """
+        keys = self.keys
+        formatted = {}
+        for item in state:
+            name = keys.get(item["key"])
+            if name is not None:
+                value = item["value"]
+                if value["type"] == 1:
+                    formatted[name] = value["bytes"]
+                else:
+                    formatted[name] = value["uint"]
+        return formatted
@@ -0,0 +1,185 @@
+# the liquidation/ and threaded/ copies of this module are kept identical
+# basic imports
+from datetime import datetime
+
+# first application arg of market calls, base64 encoded
+LIQUIDATE_ARG = "bA=="
+SEIZE_COLLATERAL_ARG = "c2M="
+
+
+def get_app_args(txn):
+    return txn.get("application-transaction", {}).get("application-args", [])
+
+
+def group_transactions(txns):
+    """Groups transactions by group id in a single pass
+
+    :param txns: list of indexer transactions, possibly with duplicates
+    :type txns: list
+    :return: dict of group id to dict of transaction id to transaction, and the
+        ids of groups holding a liquidate call in the order they were first seen
+    :rtype: tuple
+    """
+    txns_by_group = {}
+    # dict keys as an insertion ordered set
+    liquidation_gids = {}
+    for txn in txns:
+        gid = txn.get("group", None)
+        txid = txn.get("id", None)
+        group = txns_by_group.get(gid, None)
+        if group is None:
+            group = txns_by_group[gid] = {}
+        group[txid] = txn
+        if gid is not None:
+            app_args = get_app_args(txn)
+            if app_args and app_args[0] == LIQUIDATE_ARG:
+                liquidation_gids[gid] = None
+    return txns_by_group, list(liquidation_gids)
+
+
+def is_liquidation_call(txn):
+    app_args = get_app_args(txn)
+    return bool(app_args) and app_args[0] in (LIQUIDATE_ARG, SEIZE_COLLATERAL_ARG)
+
+
+def group_liquidation_transactions(app_txns, address_txns):
+    """Groups the transactions of liquidation groups only, reading each stream
+    once. Every liquidate call is a market app call, so the liquidation groups
+    are known once app_txns is drained, and address_txns are only kept for
+    them. Other market app calls are dropped as they arrive, they never change
+    a classified event.
+
+    :param app_txns: transactions of the market app searches
+    :type app_txns: iterable
+    :param address_txns: transactions of the market address searches
+    :type address_txns: iterable
+    :return: same as group_transactions, restricted to liquidation groups
+    :rtype: tuple
+    """
+    kept_txns = [
+        txn
+        for txn in app_txns
+        if txn.get("group", None) is not None
+        and (is_liquidation_call(txn) or not get_app_args(txn))
+    ]
+    txns_by_group, liquidation_gids = group_transactions(kept_txns)
+    txns_by_group = {gid: txns_by_group[gid] for gid in liquidation_gids}
+    for txn in address_txns:
+        group = txns_by_group.get(txn.get("group", None), None)
+        if group is not None:
+            group[txn.get("id", None)] = txn
+    return txns_by_group, liquidation_gids
+
+
+def get_repay_amount(txn):
+    asset_transfer_txn = txn.get("asset-transfer-transaction", {})
+    if asset_transfer_txn:
+        return asset_transfer_txn["amount"]
+    return txn["payment-transaction"]["amount"]
+
+
+def get_seized_amount(inner_txn):
+    # bAsset collateral is sent as an asset transfer, ALGO as a nested payment
+    asset_transfer_txn = inner_txn.get("asset-transfer-transaction", {})
+    if asset_transfer_txn:
+        return asset_transfer_txn["amount"], True
+    return inner_txn["inner-txns"][0]["payment-transaction"]["amount"], False
+
+
+def is_complete(event):
+    return None not in event.values()
+
+
+def classify_v1_group(gid, group_txns):
+    """Returns the raw amounts of a V1 liquidation group, None if transactions
+    of the group are missing. Amounts are in base units, the seized amount is in
+    bank units when collateral_is_bank_asset is set.
+    """
+    event = {
+        "group": gid,
+        "round": None,
+        "time": None,
+        "liquidator": None,
+        "liquidatee": None,
+        "borrow_app_id": None,
+        "collateral_app_id": None,
+        "repay_amount": None,
+        "collateral_seized": None,
+        "collateral_is_bank_asset": None,
+    }
+    for txn in group_txns.values():
+        event["round"] = txn["confirmed-round"]
+        event["time"] = datetime.fromtimestamp(txn["round-time"])
+        app_args = get_app_args(txn)
+        if app_args:
+            if app_args[0] == LIQUIDATE_ARG:
+                app_txn = txn["application-transaction"]
+                accounts = app_txn.get("accounts", [])
+                if len(accounts) == 2:
+                    event["liquidatee"] = accounts[0]
+                    event["liquidator"] = txn["sender"]
+                    event["collateral_app_id"] = app_txn["application-id"]
+                    (
+                        event["collateral_seized"],
+                        event["collateral_is_bank_asset"],
+                    ) = get_seized_amount(txn["inner-txns"][0])
+                elif len(accounts) == 1:
+                    event["borrow_app_id"] = app_txn["application-id"]
+        else:
+            event["repay_amount"] = get_repay_amount(txn)
+    return event if is_complete(event) else None
+
+
+def classify_v2_group(gid, group_txns):
+    """Returns the raw amounts of a V2 liquidation group, None if transactions
+    of the group are missing. Amounts are in base units, the seized amount is in
+    bAsset units when collateral_is_bank_asset is set.
+    """
+    event = {
+        "group": gid,
+        "round": None,
+        "time": None,
+        "liquidator": None,
+        "liquidatee": None,
+        "borrow_app_id": None,
+        "collateral_app_id": None,
+        "repay_amount": None,
+        "collateral_seized": None,
+        "collateral_is_bank_asset": None,
+    }
+    for txn in group_txns.values():
+        event["round"] = txn["confirmed-round"]
+        event["time"] = datetime.fromtimestamp(txn["round-time"])
+        app_args = get_app_args(txn)
+        if app_args:
+            app_txn = txn["application-transaction"]
+            if app_args[0] == LIQUIDATE_ARG:
+                event["borrow_app_id"] = app_txn["application-id"]
+            elif app_args[0] == SEIZE_COLLATERAL_ARG:
+                event["liquidatee"] = app_txn.get("accounts", [])[0]
+                event["liquidator"] = txn["sender"]
+                event["collateral_app_id"] = app_txn["application-id"]
+                (
+                    event["collateral_seized"],
+                    event["collateral_is_bank_asset"],
+                ) = get_seized_amount(txn["inner-txns"][1])
+        else:
+            event["repay_amount"] = get_repay_amount(txn)
+    return event if is_complete(event) else None
+
+
+def extract_events(txns_by_group, liquidation_gids, classify_group):
+    """Classifies every liquidation group once
+
+    :return: list of raw liquidation events and dict of the incomplete groups
+    :rtype: tuple
+    """
+    events = []
+    incomplete_groups = {}
+    for gid in liquidation_gids:
+        event = classify_group(gid, txns_by_group[gid])
+        if event is None:
+            incomplete_groups[gid] = txns_by_group[gid]
+        else:
+            events.append(event)
+    return events, incomplete_groups
@@ -0,0 +1,186 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from time import monotonic
+
+from retry_policy import is_rate_limited, is_transient
+
+# weight of the newest sample in the latency moving average
+LATENCY_ALPHA = 0.2
+# latency assumed for endpoints which have not answered yet
+DEFAULT_LATENCY = 0.5
+
+
+class IndexerEndpoint:
+    def __init__(self, indexer):
+        self.indexer = indexer
+        self.latency = None
+        self.in_flight = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.backoff = 0
+        self.backoff_until = 0
+
+    def get_score(self):
+        # expected wait for a new request on this endpoint
+        latency = self.latency if self.latency is not None else DEFAULT_LATENCY
+        return latency * (self.in_flight + 1)
+
+    def record_success(self, latency):
+        self.requests += 1
+        self.backoff = 0
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_ALPHA * (latency - self.latency)
+
+    def record_failure(self, e, base_backoff, max_backoff):
+        self.requests += 1
+        if is_rate_limited(e):
+            self.rate_limited += 1
+        else:
+            self.errors += 1
+        if not is_transient(e):
+            # the endpoint answered, the request itself is bad
+            return
+        self.backoff = min(max(2 * self.backoff, base_backoff), max_backoff)
+        self.backoff_until = monotonic() + self.backoff
+
+
+class IndexerPool:
+    """Spreads indexer page requests over several endpoints with asyncio.
+    Picks the endpoint with the lowest expected wait from its latency and
+    requests in flight, backs off per endpoint on 429s and other transient
+    errors, and keeps at most max_in_flight requests outstanding over the
+    whole pool.
+    """
+
+    def __init__(
+        self,
+        indexers,
+        max_in_flight=8,
+        base_backoff=1,
+        max_backoff=30,
+        max_attempts=10,
+    ):
+        self.endpoints = [IndexerEndpoint(indexer) for indexer in indexers]
+        self.max_in_flight = max_in_flight
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+
+    async def get_endpoint(self, preferred=None):
+        while True:
+            now = monotonic()
+            available = [
+                endpoint for endpoint in self.endpoints if endpoint.backoff_until <= now
+            ]
+            if preferred in available:
+                return preferred
+            if available:
+                return min(available, key=lambda endpoint: endpoint.get_score())
+            # every endpoint is backing off, wait for the first to recover
+            await asyncio.sleep(
+                min(endpoint.backoff_until for endpoint in self.endpoints) - now
+            )
+
+    async def request(self, semaphore, method_name, preferred=None, **kwargs):
+        """Returns the response of indexer method method_name and the endpoint
+        which served it. Fails over to other endpoints on transient errors,
+        classified like RetryPolicy does, and raises any other error at once.
+        """
+        async with semaphore:
+            for attempt in range(self.max_attempts):
+                endpoint = await self.get_endpoint(preferred)
+                endpoint.in_flight += 1
+                start = monotonic()
+                try:
+                    response = await asyncio.to_thread(
+                        getattr(endpoint.indexer, method_name), **kwargs
+                    )
+                except Exception as e:
+                    endpoint.record_failure(e, self.base_backoff, self.max_backoff)
+                    if not is_transient(e) or attempt == self.max_attempts - 1:
+                        raise
+                    preferred = None
+                    continue
+                finally:
+                    endpoint.in_flight -= 1
+                endpoint.record_success(monotonic() - start)
+                return response, endpoint
+
+    async def search_interval(
+        self, semaphore, method_name, min_round, max_round, **kwargs
+    ):
+        # pages of one interval stay on the endpoint which served the first one
+        elements = []
+        next_page = None
+        endpoint = None
+        while True:
+            if next_page is not None:
+                kwargs["next_page"] = next_page
+            response, endpoint = await self.request(
+                semaphore,
+                method_name,
+                preferred=endpoint,
+                min_round=min_round,
+                max_round=max_round,
+                **kwargs
+            )
+            elements.extend(response.get("transactions", []))
+            next_page = response.get("next-token", None)
+            if next_page is None:
+                return elements
+
+    async def search_async(self, method_name, min_round, max_round, n_chunks, **kwargs):
+        # the blocking sdk calls run on a thread each
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=self.max_in_flight)
+        )
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        every_blocks = ceil((max_round - min_round + 1) / n_chunks)
+        intervals = [
+            (lo, min(lo + every_blocks - 1, max_round))
+            for lo in range(min_round, max_round + 1, every_blocks)
+        ]
+        results = await asyncio.gather(
+            *[
+                self.search_interval(semaphore, method_name, lo, hi, **dict(kwargs))
+                for (lo, hi) in intervals
+            ]
+        )
+        return [txn for elements in results for txn in elements]
+
+    def search_transactions(
+        self, method_name, min_round, max_round, n_chunks=None, **kwargs
+    ):
+        """Pages a transaction search over [min_round, max_round] across the pool
+
+        :param method_name: indexer search method, e.g. "search_transactions"
+        :type method_name: str
+        :param n_chunks: number of round intervals searched concurrently, defaults
+            to twice max_in_flight so slow intervals do not idle the pool
+        :type n_chunks: int
+        :return: dict with the transactions in round interval order
+        :rtype: dict
+        """
+        if n_chunks is None:
+            n_chunks = 2 * self.max_in_flight
+        txns = asyncio.run(
+            self.search_async(method_name, min_round, max_round, n_chunks, **kwargs)
+        )
+        return {"current-round": max_round, "transactions": txns}
+
+    def print_stats(self):
+        for endpoint in self.endpoints:
+            print(
+                "%s: %d requests, %s ms latency, %d rate limited, %d errors"
+                % (
+                    endpoint.indexer.indexer_address,
+                    endpoint.requests,
+                    "-" if endpoint.latency is None else int(endpoint.latency * 1000),
+                    endpoint.rate_limited,
+                    endpoint.errors,
+                )
+            )
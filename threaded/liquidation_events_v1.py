@@ -13,14 +13,56 @@ from algosdk.v2client.indexer import IndexerClient
 # algofi imports
 from algofi.v1.client import AlgofiMainnetClient
 from algosdk.v2client.indexer import IndexerClient
-from threaded_search import threaded_search
+from threaded_search import threaded_search, iter_threaded_search
 from shared import *
+from indexer_pool import IndexerPool
+from retry_policy import RetryPolicy
+from indexer_cache import IndexerCache, get_transactions
+from event_extractor import (
+    group_transactions,
+    group_liquidation_transactions,
+    extract_events,
+    classify_v1_group,
+)
+from price_cache import HistoricalPriceCache, get_price_lookups
+from events_checkpoint import load_checkpoint, save_checkpoint, append_events
 
 # progress bar imports
 from tqdm.contrib.concurrent import thread_map
 from tqdm import tqdm
 
 
+def get_event_row(price_cache, markets, market_id_to_name, event):
+    round_ = event["round"]
+    borrow_market = market_id_to_name[event["borrow_app_id"]]
+    collateral_market = market_id_to_name[event["collateral_app_id"]]
+    collateral_seized_amount = event["collateral_seized"]
+    if event["collateral_is_bank_asset"]:
+        bank_to_exchange_rate = price_cache.get_exchange_rate(
+            collateral_market, round_
+        )
+        collateral_seized_amount *= bank_to_exchange_rate / 1e9
+    collateral_seized_amount /= 10 ** (
+        markets[collateral_market].asset.get_underlying_decimals()
+    )
+    borrow_price = price_cache.get_price(borrow_market, round_)
+    repay_amount = event["repay_amount"] / 10 ** (
+        markets[borrow_market].asset.get_underlying_decimals()
+    )
+    # same order as EVENT_COLUMNS
+    return (
+        event["time"],
+        event["group"],
+        event["liquidator"],
+        event["liquidatee"],
+        borrow_market,
+        collateral_market,
+        repay_amount,
+        collateral_seized_amount,
+        0.07 * repay_amount * borrow_price,
+    )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Input processor")
     parser.add_argument(
@@ -34,7 +76,19 @@ if __name__ == "__main__":
     parser.add_argument("--block_delta", type=int, default=20000)
     parser.add_argument("--n_threads", type=int, default=len(ENDPOINTS))
     parser.add_argument("--csv_fpath", type=str, required=True)
+    parser.add_argument("--work_stealing", action="store_true")
+    parser.add_argument("--cache_fpath", type=str, default="")
+    parser.add_argument("--async_pool", action="store_true")
+    parser.add_argument("--max_in_flight", type=int, default=8)
+    parser.add_argument("--max_attempts", type=int, default=8)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--incremental", action="store_true")
+    parser.add_argument("--price_cache_fpath", type=str, default="")
     args = parser.parse_args()
+    if args.stream and (args.cache_fpath or args.async_pool or args.work_stealing):
+        parser.error(
+            "--stream does not support --cache_fpath, --async_pool or --work_stealing"
+        )
 
     # initialize clients
     algod_client = AlgodClient(args.algod_token, args.algod_uri)
@@ -53,148 +107,120 @@ if __name__ == "__main__":
 
     timestamp = get_time()
 
-    # prepare space for each job's thread
-    txns_by_group = []
-    for _, i in zip(range(args.n_threads), cycle(range(len(algofis)))):
-        txns_by_group.append(
-            [algofis[i], {}]
-        )
+    # resume after the last processed round
+    checkpoint_fpath = args.csv_fpath + "v1-liquidation-events-checkpoint.json"
+    if args.incremental:
+        checkpoint = load_checkpoint(checkpoint_fpath)
+        if checkpoint["last_round"] is not None:
+            start_round = checkpoint["last_round"] + 1
 
-    # get transaction in each market
-    txns = []
-    for i, _ in enumerate(market_app_ids):
-        market_app_id = market_app_ids[i]
-        market_address = market_addresses[i]
+    indexer_cache = IndexerCache(args.cache_fpath) if args.cache_fpath else None
 
-        txns.extend(
-            threaded_search(
+    indexer_pool = IndexerPool(
+        indexers, max_in_flight=args.max_in_flight, max_attempts=args.max_attempts
+    )
+    retry_policy = RetryPolicy(max_attempts=args.max_attempts)
+
+    def fetch_threaded(search_func, min_round, max_round, **kwargs):
+        if args.async_pool:
+            # spread the pages over every configured indexer
+            return indexer_pool.search_transactions(
+                search_func.__name__, min_round, max_round, limit=10000, **kwargs
+            )['transactions']
+        return threaded_search(
+            search_func,
+            args.n_threads,
+            min_round,
+            max_round,
+            work_stealing=args.work_stealing,
+            retry_policy=retry_policy,
+            limit=10000,
+            **kwargs
+        )['transactions']
+
+    def iter_app_txns():
+        # stream pages into group assembly as they land
+        for market_app_id in market_app_ids:
+            yield from iter_threaded_search(
                 algofi_client.indexer.search_transactions,
                 args.n_threads,
                 start_round,
                 current_round,
+                retry_policy=retry_policy,
                 application_id=market_app_id,
-                limit=10000
-            )['transactions']
-        )
+                limit=10000,
+            )
 
-        txns.extend(
-            threaded_search(
+    def iter_address_txns():
+        for market_address in market_addresses:
+            yield from iter_threaded_search(
                 algofi_client.indexer.search_transactions_by_address,
                 args.n_threads,
                 start_round,
                 current_round,
+                retry_policy=retry_policy,
                 address=market_address,
-                limit=10000
-            )['transactions']
+                limit=10000,
+            )
+
+    if args.stream:
+        # only the transactions of liquidation groups are held in memory
+        txns_by_group, liquidation_gids = group_liquidation_transactions(
+            iter_app_txns(), iter_address_txns()
         )
-    
-    # create by gid dict
-    group_ids = {}
-    for txn, i in zip(txns, cycle(range(args.n_threads))):
-        txid, gid = txn.get('id'), txn.get('group')
-
-        if gid not in group_ids:
-            group_ids[gid] = i
-
-            txns_by_group[i][1][gid]= {txid: txn}
-        else:
-            txns_by_group[group_ids[gid]][1][gid][txid] = txn
-
-    def get_data_dict(txns_by_group):
-        algofi_client, groups = txns_by_group
-        
-        for gid, txns in tqdm(groups.items()):
-            for txn in txns.values():
-                app_args = txn.get("application-transaction", {}).get("application-args", [])
-                if app_args:
-                    # liquidate or liquidate_update transaction
-                    if app_args[0] == "bA==":
-                        for liq_txn_id in groups[gid]:
-                            liq_txn = groups[gid][liq_txn_id]
-                            unix_time = liq_txn["round-time"]
-                            round_ = liq_txn["confirmed-round"]
-                            timestamp = datetime.fromtimestamp(unix_time)
-                            app_args = liq_txn.get("application-transaction", {}).get(
-                                "application-args", []
-                            )
-                            if app_args:
-                                if app_args[0] == "bA==":
-                                    accounts = liq_txn.get(
-                                        "application-transaction", {}
-                                    ).get("accounts", [])
-                                    if len(accounts) == 2:
-                                        liquidatee = accounts[0]
-                                        liquidator = liq_txn["sender"]
-                                        market_app_id = liq_txn["application-transaction"][
-                                            "application-id"
-                                        ]
-                                        collateral_market = market_id_to_name[market_app_id]
-                                        inner_txn = liq_txn["inner-txns"][0]
-                                        asset_transfer_txn = inner_txn.get(
-                                            "asset-transfer-transaction", {}
-                                        )
-                                        if asset_transfer_txn:
-                                            collateral_seized_amount = asset_transfer_txn[
-                                                "amount"
-                                            ]
-                                            while True:
-                                                try:
-                                                    bank_to_exchange_rate = algofi_client.markets[
-                                                        collateral_market
-                                                    ].get_bank_to_underlying_exchange(block=round_)
-                                                    collateral_seized_amount *= (
-                                                        bank_to_exchange_rate / 1e9
-                                                    )
-                                                    break
-                                                except Exception:
-                                                    sleep(1)
-                                        else:
-                                            collateral_seized_amount = inner_txn[
-                                                "inner-txns"
-                                            ][0]["payment-transaction"]["amount"]
-                                        collateral_seized_amount /= 10 ** (
-                                            markets[
-                                                collateral_market
-                                            ].asset.get_underlying_decimals()
-                                        )
-                                    elif len(accounts) == 1:
-                                        borrow_market = market_id_to_name[
-                                            liq_txn["application-transaction"][
-                                                "application-id"
-                                            ]
-                                        ]
-                                        while True:
-                                            try:
-                                                borrow_price = algofi_client.markets[
-                                                    borrow_market
-                                                ].asset.get_price(block=round_)
-                                                break
-                                            except Exception:
-                                                sleep(1)
-                            else:
-                                asset_transfer_txn = liq_txn.get(
-                                    "asset-transfer-transaction", {}
-                                )
-                                if asset_transfer_txn:
-                                    repay_amount = asset_transfer_txn["amount"]
-                                else:
-                                    repay_amount = liq_txn["payment-transaction"]["amount"]
-                        repay_amount /= 10 ** (
-                            markets[borrow_market].asset.get_underlying_decimals()
-                        )
-                        DATA_DICT["Time"].append(timestamp)
-                        DATA_DICT["Group"].append(gid)
-                        DATA_DICT["Liquidator"].append(liquidator)
-                        DATA_DICT["Liquidatee"].append(liquidatee)
-                        DATA_DICT["Borrow Market"].append(borrow_market)
-                        DATA_DICT["Collateral Market"].append(collateral_market)
-                        DATA_DICT["Repay Amount"].append(repay_amount)
-                        DATA_DICT["Collateral Seized"].append(collateral_seized_amount)
-                        DATA_DICT["Profit [$]"].append(0.07 * repay_amount * borrow_price)
-                        sleep(0.1)
-                        break
-
-    thread_map(get_data_dict, txns_by_group, max_workers=args.n_threads)
-
-    df = pd.DataFrame(DATA_DICT).sort_values(by="Time")
-    df.to_csv(args.csv_fpath + "v1-liquidation-events-%s.csv" % timestamp)
+    else:
+        # get transaction in each market
+        txns = []
+        for i, _ in enumerate(market_app_ids):
+            market_app_id = market_app_ids[i]
+            market_address = market_addresses[i]
+
+            txns.extend(
+                get_transactions(
+                    indexer_cache,
+                    algofi_client.indexer.search_transactions,
+                    start_round,
+                    current_round,
+                    fetch=fetch_threaded,
+                    application_id=market_app_id,
+                )
+            )
+
+            txns.extend(
+                get_transactions(
+                    indexer_cache,
+                    algofi_client.indexer.search_transactions_by_address,
+                    start_round,
+                    current_round,
+                    fetch=fetch_threaded,
+                    address=market_address,
+                )
+            )
+        # create by gid dict
+        txns_by_group, liquidation_gids = group_transactions(txns)
+
+    events, _ = extract_events(txns_by_group, liquidation_gids, classify_v1_group)
+
+    # the historical reads are spread over the threads and every configured
+    # indexer, pricing is then local
+    price_cache = HistoricalPriceCache(
+        algofis, args.price_cache_fpath, n_threads=args.n_threads
+    )
+    price_cache.prefetch(*get_price_lookups(market_id_to_name, events))
+    price_cache.save()
+    rows = [
+        get_event_row(price_cache, markets, market_id_to_name, event)
+        for event in events
+    ]
+
+    if args.async_pool:
+        indexer_pool.print_stats()
+    else:
+        retry_policy.print_stats()
+
+    df = pd.DataFrame(rows, columns=EVENT_COLUMNS).sort_values(by="Time")
+    if args.incremental:
+        append_events(args.csv_fpath + "v1-liquidation-events.csv", df)
+        save_checkpoint(checkpoint_fpath, current_round)
+    else:
+        df.to_csv(args.csv_fpath + "v1-liquidation-events-%s.csv" % timestamp)
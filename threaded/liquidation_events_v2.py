@@ -15,14 +15,46 @@ from algosdk.v2client.indexer import IndexerClient
 from algofipy.lending.v2.lending_config import MANAGER_STRINGS, MARKET_STRINGS
 from algofipy.algofi_client import AlgofiClient
 from algofipy.globals import Network
-from threaded_search import threaded_search
+from threaded_search import threaded_search, iter_threaded_search
 from shared import *
+from indexer_pool import IndexerPool
+from retry_policy import RetryPolicy
+from indexer_cache import IndexerCache, get_transactions
+from event_extractor import (
+    group_transactions,
+    group_liquidation_transactions,
+    classify_v2_group,
+)
+from market_snapshot import get_market_snapshot
+from events_checkpoint import load_checkpoint, save_checkpoint, append_events
 
 # progress bar imports
 from tqdm.contrib.concurrent import thread_map
 from tqdm import tqdm
 
 
+def get_event_row(snapshot, event):
+    borrow_market = snapshot[event["borrow_app_id"]]
+    collateral_market = snapshot[event["collateral_app_id"]]
+    collateral_seized_amount = event["collateral_seized"]
+    if event["collateral_is_bank_asset"]:
+        collateral_seized_amount *= collateral_market.b_asset_exchange_rate
+    collateral_seized_amount /= 10**collateral_market.decimals
+    repay_amount = event["repay_amount"] / 10**borrow_market.decimals
+    # same order as EVENT_COLUMNS
+    return (
+        event["time"],
+        event["group"],
+        event["liquidator"],
+        event["liquidatee"],
+        borrow_market.name,
+        collateral_market.name,
+        repay_amount,
+        collateral_seized_amount,
+        0.07 * repay_amount * borrow_market.price,
+    )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Input processor")
     parser.add_argument(
@@ -36,7 +68,18 @@ if __name__ == "__main__":
     parser.add_argument("--block_delta", type=int, default=20000)
     parser.add_argument("--n_threads", type=int, default=len(ENDPOINTS))
     parser.add_argument("--csv_fpath", type=str, required=True)
+    parser.add_argument("--work_stealing", action="store_true")
+    parser.add_argument("--cache_fpath", type=str, default="")
+    parser.add_argument("--async_pool", action="store_true")
+    parser.add_argument("--max_in_flight", type=int, default=8)
+    parser.add_argument("--max_attempts", type=int, default=8)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--incremental", action="store_true")
     args = parser.parse_args()
+    if args.stream and (args.cache_fpath or args.async_pool or args.work_stealing):
+        parser.error(
+            "--stream does not support --cache_fpath, --async_pool or --work_stealing"
+        )
 
     # initialize clients
     algod_client = AlgodClient(args.algod_token, args.algod_uri)
@@ -55,151 +98,129 @@ if __name__ == "__main__":
 
     timestamp = get_time()
 
+    # resume after the last processed round
+    checkpoint_fpath = args.csv_fpath + "v2-liquidation-events-checkpoint.json"
+    if args.incremental:
+        checkpoint = load_checkpoint(checkpoint_fpath)
+        if checkpoint["last_round"] is not None:
+            start_round = checkpoint["last_round"] + 1
+
+    # prices, exchange rates and decimals are read once and shared by the jobs
+    snapshot = get_market_snapshot(algofi_client)
+
     # prepare space for each job's thread
-    txns_by_group = []
-    for _, i in zip(range(args.n_threads), cycle(range(len(algofis)))):
-        txns_by_group.append(
-            [algofis[i], {}]
-        )
+    jobs = [[] for _ in range(args.n_threads)]
 
-    # get transaction in each market
-    txns = []
-    for i, _ in enumerate(market_app_ids):
-        market_app_id = market_app_ids[i]
-        market_address = market_addresses[i]
+    indexer_cache = IndexerCache(args.cache_fpath) if args.cache_fpath else None
 
-        txns.extend(
-            threaded_search(
+    indexer_pool = IndexerPool(
+        indexers, max_in_flight=args.max_in_flight, max_attempts=args.max_attempts
+    )
+    retry_policy = RetryPolicy(max_attempts=args.max_attempts)
+
+    def fetch_threaded(search_func, min_round, max_round, **kwargs):
+        if args.async_pool:
+            # spread the pages over every configured indexer
+            return indexer_pool.search_transactions(
+                search_func.__name__, min_round, max_round, limit=10000, **kwargs
+            )['transactions']
+        return threaded_search(
+            search_func,
+            args.n_threads,
+            min_round,
+            max_round,
+            work_stealing=args.work_stealing,
+            retry_policy=retry_policy,
+            limit=10000,
+            **kwargs
+        )['transactions']
+
+    def iter_app_txns():
+        # stream pages into group assembly as they land
+        for market_app_id in market_app_ids:
+            yield from iter_threaded_search(
                 algofi_client.indexer.search_transactions,
                 args.n_threads,
                 start_round,
                 current_round,
+                retry_policy=retry_policy,
                 application_id=market_app_id,
-                limit=10000
-            )['transactions']
-        )
+                limit=10000,
+            )
 
-        txns.extend(
-            threaded_search(
+    def iter_address_txns():
+        for market_address in market_addresses:
+            yield from iter_threaded_search(
                 algofi_client.indexer.search_transactions_by_address,
                 args.n_threads,
                 start_round,
                 current_round,
+                retry_policy=retry_policy,
                 address=market_address,
-                limit=10000
-            )['transactions']
-        )
-
-    # create by gid dict
-    group_ids = {}
-    for txn, i in zip(txns, cycle(range(args.n_threads))):
-        txid, gid = txn.get('id'), txn.get('group')
+                limit=10000,
+            )
 
-        if gid not in group_ids:
-            group_ids[gid] = i
-
-            txns_by_group[i][1][gid]= {txid: txn}
-        else:
-            txns_by_group[group_ids[gid]][1][gid][txid] = txn
-
-    
-    def get_data_dict(txns_by_group):
-        algofi_client, groups = txns_by_group
-
-        for gid, txns in tqdm(groups.items()):
-            for txn in txns.values():
-                app_args = txn.get("application-transaction", {}).get("application-args", [])
-                if app_args:
-                    # liquidate or liquidate_update transaction
-                    if app_args[0] == "bA==":
-                        for liq_txn_id in groups[gid]:
-                            liq_txn = groups[gid][liq_txn_id]
-                            unix_time = liq_txn["round-time"]
-                            round_ = liq_txn["confirmed-round"]
-                            timestamp = datetime.fromtimestamp(unix_time)
-                            app_args = liq_txn.get("application-transaction", {}).get(
-                                "application-args", []
-                            )
-                            if app_args:
-                                if app_args[0] == "bA==":
-                                    borrow_app_id = liq_txn["application-transaction"][
-                                        "application-id"
-                                    ]
-                                    borrow_market = market_id_to_name[borrow_app_id]
-                                    while True:
-                                        try:
-                                            borrow_price = (
-                                                markets[borrow_app_id].oracle.raw_price / 1000000
-                                            )
-                                            break
-                                        except Exception:
-                                            sleep(1)
-                                elif app_args[0] == "c2M=":
-                                    accounts = liq_txn.get(
-                                        "application-transaction", {}
-                                    ).get("accounts", [])
-                                    liquidatee = accounts[0]
-                                    liquidator = liq_txn["sender"]
-                                    market_app_id = liq_txn["application-transaction"][
-                                        "application-id"
-                                    ]
-                                    collateral_market = market_id_to_name[market_app_id]
-                                    inner_txn = liq_txn["inner-txns"][1]
-                                    asset_transfer_txn = inner_txn.get(
-                                        "asset-transfer-transaction", {}
-                                    )
-                                    if asset_transfer_txn:
-                                        collateral_seized_amount = asset_transfer_txn[
-                                            "amount"
-                                        ]
-                                        bank_to_exchange_rate = (
-                                            markets[market_app_id]
-                                            .b_asset_to_asset_amount(1e9)
-                                            .underlying
-                                            / 1e9
-                                        )
-                                        collateral_seized_amount *= bank_to_exchange_rate
-                                    else:
-                                        collateral_seized_amount = inner_txn["inner-txns"][
-                                            0
-                                        ]["payment-transaction"]["amount"]
-                                    decimals = (
-                                        markets[market_app_id]
-                                        .lending_client.algofi_client.assets[
-                                            markets[market_app_id].underlying_asset_id
-                                        ]
-                                        .decimals
-                                    )
-                                    collateral_seized_amount /= 10 ** (decimals)
-                            else:
-                                asset_transfer_txn = liq_txn.get(
-                                    "asset-transfer-transaction", {}
-                                )
-                                if asset_transfer_txn:
-                                    repay_amount = asset_transfer_txn["amount"]
-                                else:
-                                    repay_amount = liq_txn["payment-transaction"]["amount"]
-                        borrow_decimals = (
-                            markets[borrow_app_id]
-                            .lending_client.algofi_client.assets[
-                                markets[borrow_app_id].underlying_asset_id
-                            ]
-                            .decimals
-                        )
-                        repay_amount /= 10**borrow_decimals
-                        DATA_DICT["Time"].append(timestamp)
-                        DATA_DICT["Group"].append(gid)
-                        DATA_DICT["Liquidator"].append(liquidator)
-                        DATA_DICT["Liquidatee"].append(liquidatee)
-                        DATA_DICT["Borrow Market"].append(borrow_market)
-                        DATA_DICT["Collateral Market"].append(collateral_market)
-                        DATA_DICT["Repay Amount"].append(repay_amount)
-                        DATA_DICT["Collateral Seized"].append(collateral_seized_amount)
-                        DATA_DICT["Profit [$]"].append(0.07 * repay_amount * borrow_price)
-                        sleep(0.1)
-                        break
-
-    thread_map(get_data_dict, txns_by_group, max_workers=args.n_threads)
-
-    df = pd.DataFrame(DATA_DICT).sort_values(by="Time")
-    df.to_csv(args.csv_fpath + "v2-liquidation-events-%s.csv" % timestamp)
+    if args.stream:
+        # only the transactions of liquidation groups are held in memory
+        txns_by_group, liquidation_gids = group_liquidation_transactions(
+            iter_app_txns(), iter_address_txns()
+        )
+    else:
+        # get transaction in each market
+        txns = []
+        for i, _ in enumerate(market_app_ids):
+            market_app_id = market_app_ids[i]
+            market_address = market_addresses[i]
+
+            txns.extend(
+                get_transactions(
+                    indexer_cache,
+                    algofi_client.indexer.search_transactions,
+                    start_round,
+                    current_round,
+                    fetch=fetch_threaded,
+                    application_id=market_app_id,
+                )
+            )
+
+            txns.extend(
+                get_transactions(
+                    indexer_cache,
+                    algofi_client.indexer.search_transactions_by_address,
+                    start_round,
+                    current_round,
+                    fetch=fetch_threaded,
+                    address=market_address,
+                )
+            )
+        # create by gid dict
+        txns_by_group, liquidation_gids = group_transactions(txns)
+
+    # spread the liquidation groups over the jobs
+    for gid, job in zip(liquidation_gids, cycle(jobs)):
+        job.append(gid)
+
+    def get_rows(gids):
+        # each job collects its own rows, the main thread merges them
+        rows = []
+        for gid in tqdm(gids):
+            event = classify_v2_group(gid, txns_by_group[gid])
+            if event is not None:
+                rows.append(get_event_row(snapshot, event))
+        return rows
+
+    results = thread_map(get_rows, jobs, max_workers=args.n_threads)
+
+    if args.async_pool:
+        indexer_pool.print_stats()
+    else:
+        retry_policy.print_stats()
+
+    df = pd.DataFrame(
+        [row for rows in results for row in rows], columns=EVENT_COLUMNS
+    ).sort_values(by="Time")
+    if args.incremental:
+        append_events(args.csv_fpath + "v2-liquidation-events.csv", df)
+        save_checkpoint(checkpoint_fpath, current_round)
+    else:
+        df.to_csv(args.csv_fpath + "v2-liquidation-events-%s.csv" % timestamp)
@@ -0,0 +1,39 @@
+# the liquidation/ and threaded/ copies of this module are kept identical
+# basic imports
+from collections import namedtuple
+from time import sleep
+from types import MappingProxyType
+
+MAX_ATTEMPTS = 5
+
+MarketSnapshot = namedtuple(
+    "MarketSnapshot", ["name", "price", "b_asset_exchange_rate", "decimals"]
+)
+
+
+def get_market_snapshot(algofi_client):
+    """Returns the V2 market values the liquidation events need, read once per run
+
+    :param algofi_client: V2 algofi client
+    :type algofi_client: :class:`AlgofiClient`
+    :return: read-only dict of market app id to :class:`MarketSnapshot`, safe to
+        share between threads
+    :rtype: :class:`MappingProxyType`
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            snapshot = {}
+            for market_app_id, market in algofi_client.lending.markets.items():
+                snapshot[market_app_id] = MarketSnapshot(
+                    name=market.name,
+                    price=market.oracle.raw_price / 1000000,
+                    b_asset_exchange_rate=market.b_asset_to_asset_amount(1e9).underlying
+                    / 1e9,
+                    decimals=algofi_client.assets[market.underlying_asset_id].decimals,
+                )
+            return MappingProxyType(snapshot)
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            print(e)
+            sleep(2**attempt)
@@ -0,0 +1,216 @@
+import random
+import re
+from http.client import HTTPException
+from threading import Lock
+from time import monotonic, sleep
+from urllib.error import HTTPError, URLError
+
+from algosdk.error import IndexerHTTPError
+
+# status code at the start of an error message, e.g. "HTTP Error 429: ..."
+STATUS_CODE_PATTERN = re.compile(r"^(?:HTTP Error )?([1-5]\d\d)\b")
+# indexer answers to bad requests, which a retry can not change
+PERMANENT_MESSAGE_PATTERN = re.compile(r"invalid|not found|no \w+ found|unknown param")
+
+
+def get_endpoint(search_func):
+    # indexer address of a bound search method
+    return getattr(getattr(search_func, "__self__", None), "indexer_address", None)
+
+
+def get_status_code(e):
+    """Returns the http status code of an error, None if it is not known.
+    Algod and urllib errors carry it, the indexer errors of the sdk only carry
+    the response message, which may start with it.
+    """
+    code = getattr(e, "code", None)
+    if isinstance(code, int):
+        return code
+    match = STATUS_CODE_PATTERN.match(str(e))
+    return int(match.group(1)) if match else None
+
+
+def is_rate_limited(e):
+    message = str(e).lower()
+    return (
+        get_status_code(e) == 429
+        or "too many requests" in message
+        or "rate limit" in message
+    )
+
+
+def is_transient(e):
+    # only 429 and 5xx are worth a retry
+    code = get_status_code(e)
+    if code is not None:
+        return code == 429 or code >= 500
+    if isinstance(e, IndexerHTTPError):
+        # without a code, retry unless the message is a known bad request
+        return PERMANENT_MESSAGE_PATTERN.search(str(e).lower()) is None
+    # timeouts and dropped connections, URLError is an OSError
+    return isinstance(e, (OSError, HTTPException))
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures on one endpoint.
+    While open every caller waits out the cooldown instead of hitting the
+    endpoint, then a single trial call decides whether it closes again.
+    """
+
+    def __init__(self, failure_threshold, cooldown):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = Lock()
+
+    def get_wait(self):
+        # seconds to wait before calling the endpoint, 0 to call now
+        with self.lock:
+            if self.opened_at is None:
+                return 0
+            remaining = self.opened_at + self.cooldown - monotonic()
+            if remaining > 0:
+                return remaining
+            if self.trial_in_flight:
+                return self.cooldown / 10
+            self.trial_in_flight = True
+            return 0
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = monotonic()
+
+
+class RetryPolicy:
+    """Retries transient indexer errors with exponential backoff and jitter, up
+    to max_attempts calls, with a circuit breaker per endpoint. Other errors are
+    raised right away. Counters are shared by all threads using the policy.
+    """
+
+    def __init__(
+        self,
+        max_attempts=8,
+        base_delay=0.5,
+        max_delay=30,
+        jitter=1.0,
+        failure_threshold=5,
+        cooldown=30,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.breakers = {}
+        self.lock = Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.retry_wait = 0.0
+        self.breaker_wait = 0.0
+
+    def get_breaker(self, endpoint):
+        with self.lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(
+                    self.failure_threshold, self.cooldown
+                )
+            return self.breakers[endpoint]
+
+    def get_delay(self, attempt):
+        # jitter keeps threads that failed together from retrying in lockstep
+        delay = min(self.max_delay, self.base_delay * 2**attempt)
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+    def add_counts(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def call(self, func, endpoint=None, **kwargs):
+        breaker = self.get_breaker(endpoint)
+        for attempt in range(self.max_attempts):
+            wait = breaker.get_wait()
+            while wait > 0:
+                sleep(wait)
+                self.add_counts(breaker_wait=wait)
+                wait = breaker.get_wait()
+            self.add_counts(calls=1)
+            try:
+                result = func(**kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    # the endpoint answered, so the breaker counts a success
+                    breaker.record_success()
+                    self.add_counts(failures=1)
+                    raise
+                breaker.record_failure()
+                if attempt == self.max_attempts - 1:
+                    self.add_counts(failures=1)
+                    raise
+                delay = self.get_delay(attempt)
+                print("%s, retrying in %.1fs" % (e, delay))
+                sleep(delay)
+                self.add_counts(retries=1, retry_wait=delay)
+                continue
+            breaker.record_success()
+            return result
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "retry_wait": self.retry_wait,
+                "breaker_wait": self.breaker_wait,
+            }
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print(
+            "%d calls, %d retries, %d failures, %.1fs in backoff and %.1fs in open "
+            "circuits summed over threads" % tuple(stats.values())
+        )
+
+
+if __name__ == "__main__":
+    # check the classification against the exceptions the sdk and urllib raise
+    for e, transient in [
+        (IndexerHTTPError("429 Too Many Requests"), True),
+        (IndexerHTTPError("Too Many Requests"), True),
+        (IndexerHTTPError("upstream connect error"), True),
+        (IndexerHTTPError("invalid input: unable to parse round"), False),
+        (IndexerHTTPError("no accounts found for address"), False),
+        (HTTPError("https://indexer", 503, "Service Unavailable", None, None), True),
+        (HTTPError("https://indexer", 400, "Bad Request", None, None), False),
+        (URLError("timed out"), True),
+        (ValueError("bad response"), False),
+    ]:
+        assert is_transient(e) == transient, repr(e)
+
+    # a rate limited indexer is retried until it answers
+    answers = [IndexerHTTPError("Too Many Requests")] * 2 + [{"transactions": []}]
+
+    def search():
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    policy = RetryPolicy(base_delay=0.01)
+    assert policy.call(search) == {"transactions": []}
+    assert policy.get_stats()["calls"] == 3
+    print("retry policy checks passed")
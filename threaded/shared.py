@@ -15,14 +15,15 @@ ENDPOINTS = {"Node": [
     ]}
 
 
-DATA_DICT = {
-    "Time": [],
-    "Group": [],
-    "Liquidator": [],
-    "Liquidatee": [],
-    "Borrow Market": [],
-    "Collateral Market": [],
-    "Repay Amount": [],
-    "Collateral Seized": [],
-    "Profit [$]": [],
-}
+# columns of the liquidation events csv, rows are tuples in this order
+EVENT_COLUMNS = [
+    "Time",
+    "Group",
+    "Liquidator",
+    "Liquidatee",
+    "Borrow Market",
+    "Collateral Market",
+    "Repay Amount",
+    "Collateral Seized",
+    "Profit [$]",
+]
@@ -1,33 +1,263 @@
 from time import perf_counter, sleep
 from math import ceil
+from itertools import chain
+import argparse
+from queue import Queue, Full
+from threading import Thread, Event
 from algosdk.v2client.indexer import IndexerClient
-from algosdk.error import IndexerHTTPError
 from tqdm.contrib.concurrent import thread_map
+from tqdm import tqdm
+from retry_policy import RetryPolicy, get_endpoint
 
 NUM_THREADS = 10
+# ranges narrower than this are paged through instead of being split again
+MIN_SPLIT_ROUNDS = 10
 func_wrapper = None
 
 
-def threaded_search(search_func, n_threads, min_round, max_round, **kwargs):
-    global func_wrapper
-    
+def get_search_key(response):
+    return [key for key, value in response.items() if isinstance(value, list)][0]
+
+
+def split_remaining_range(elements, min_round, max_round):
+    """Returns the transactions of a full first page which lie in rounds the
+    page covers completely, the first round of those, and the round range
+    left to search. Handles both ascending and descending page ordering.
+    """
+    first_round = elements[0]["confirmed-round"]
+    last_round = elements[-1]["confirmed-round"]
+    if first_round <= last_round:
+        kept = [el for el in elements if el["confirmed-round"] < last_round]
+        return kept, min_round, (last_round, max_round)
+    kept = [el for el in elements if el["confirmed-round"] > last_round]
+    return kept, last_round + 1, (min_round, last_round)
+
+
+def work_stealing_search(
+    search_func, n_threads, search_intervals, retry_policy, **kwargs
+):
+    """Pages the search intervals with a pool of workers sharing one queue.
+    A worker whose first page of an interval comes back full splits the rest
+    of the interval in half and queues the upper half for idle workers.
+    """
+    limit = kwargs.get("limit", None)
+    endpoint = get_endpoint(search_func)
+    intervals = Queue()
+    chunks = []
+    errors = []
+    progress = tqdm(total=search_intervals[-1][1] - search_intervals[0][0] + 1)
+
+    def search_interval(min_round, max_round):
+        while True:
+            els = retry_policy.call(
+                search_func,
+                endpoint=endpoint,
+                min_round=min_round,
+                max_round=max_round,
+                **kwargs
+            )
+            search_key = get_search_key(els)
+            elements = els[search_key]
+            next_page = els.get("next-token", None)
+            is_full = (
+                next_page is not None
+                and len(elements) > 0
+                and (limit is None or len(elements) >= limit)
+            )
+            if is_full and max_round - min_round >= MIN_SPLIT_ROUNDS:
+                kept, kept_min, (rest_min, rest_max) = split_remaining_range(
+                    elements, min_round, max_round
+                )
+                if rest_max > rest_min:
+                    mid_round = (rest_min + rest_max) // 2
+                    intervals.put((mid_round + 1, rest_max))
+                    chunks.append((kept_min, search_key, kept))
+                    progress.update(
+                        (max_round - min_round + 1) - (rest_max - rest_min + 1)
+                    )
+                    min_round, max_round = rest_min, mid_round
+                    continue
+
+            while next_page is not None:
+                els = retry_policy.call(
+                    search_func,
+                    endpoint=endpoint,
+                    min_round=min_round,
+                    max_round=max_round,
+                    next_page=next_page,
+                    **kwargs
+                )
+                next_page = els.get("next-token", None)
+                elements.extend(els[search_key])
+            chunks.append((min_round, search_key, elements))
+            progress.update(max_round - min_round + 1)
+            return
+
+    def worker():
+        while True:
+            interval = intervals.get()
+            try:
+                if interval is None:
+                    return
+                search_interval(*interval)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                intervals.task_done()
+
+    for interval in search_intervals:
+        intervals.put(interval)
+    workers = [Thread(target=worker, daemon=True) for _ in range(n_threads)]
+    for thread in workers:
+        thread.start()
+    intervals.join()
+    for _ in workers:
+        intervals.put(None)
+    for thread in workers:
+        thread.join()
+    progress.close()
+
+    if errors:
+        raise errors[0]
+
+    # chunks partition the searched rounds, so sorting them restores round order
+    chunks.sort(key=lambda chunk: chunk[0])
+    return chunks
+
+
+def get_search_intervals(n_threads, min_round, max_round):
     rounds_to_search = max_round - min_round
     every_blocks = ceil( rounds_to_search / n_threads )
 
-    search_intervals = [
+    return [
         (min_round + i*every_blocks, min_round + (( i + 1 )*every_blocks - 1) if i != n_threads - 1 else max_round)
         for i in range(n_threads)
     ]
 
-    def func_wrapper(min_max_round):
-        while True:
+
+def threaded_search_pages(
+    search_func,
+    n_threads,
+    min_round,
+    max_round,
+    max_pending_pages=None,
+    retry_policy=None,
+    **kwargs
+):
+    """Yields the pages of the search as soon as the workers receive them. At
+    most max_pending_pages pages wait for the consumer, workers block after
+    that. Pages come in arrival order, not round order.
+    """
+    if retry_policy is None:
+        retry_policy = RetryPolicy()
+    if max_pending_pages is None:
+        max_pending_pages = 2 * n_threads
+    endpoint = get_endpoint(search_func)
+    pages = Queue(maxsize=max_pending_pages)
+    stop = Event()
+    done = object()
+
+    def put(item):
+        # give up once the consumer went away
+        while not stop.is_set():
             try:
-                els = search_func(min_round=min_max_round[0], max_round=min_max_round[1], **kwargs)
-                break
-            except (IndexerHTTPError, Exception) as e:
-                print(e)
-                sleep(1)
-        
+                pages.put(item, timeout=1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def worker(min_round, max_round):
+        try:
+            params = dict(kwargs)
+            while True:
+                els = retry_policy.call(
+                    search_func,
+                    endpoint=endpoint,
+                    min_round=min_round,
+                    max_round=max_round,
+                    **params
+                )
+                if not put(els[get_search_key(els)]):
+                    return
+                params["next_page"] = els.get("next-token", None)
+                if params["next_page"] is None:
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    workers = [
+        Thread(target=worker, args=interval, daemon=True)
+        for interval in get_search_intervals(n_threads, min_round, max_round)
+    ]
+    for thread in workers:
+        thread.start()
+
+    try:
+        n_done = 0
+        while n_done < len(workers):
+            page = pages.get()
+            if page is done:
+                n_done += 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        stop.set()
+
+
+def iter_threaded_search(search_func, n_threads, min_round, max_round, **kwargs):
+    # the elements of threaded_search_pages one by one
+    for page in threaded_search_pages(
+        search_func, n_threads, min_round, max_round, **kwargs
+    ):
+        yield from page
+
+
+def merge_results(results):
+    # concatenate in order, copying every element once
+    return list(chain.from_iterable(results))
+
+
+def threaded_search(
+    search_func,
+    n_threads,
+    min_round,
+    max_round,
+    work_stealing=False,
+    retry_policy=None,
+    **kwargs
+):
+    global func_wrapper
+
+    if retry_policy is None:
+        retry_policy = RetryPolicy()
+    endpoint = get_endpoint(search_func)
+
+    search_intervals = get_search_intervals(n_threads, min_round, max_round)
+
+    if work_stealing:
+        chunks = work_stealing_search(
+            search_func, n_threads, search_intervals, retry_policy, **kwargs
+        )
+        search_key = chunks[0][1]
+        return {
+            "current-round": max_round,
+            search_key: merge_results(elements for _, _, elements in chunks),
+        }
+
+    def func_wrapper(min_max_round):
+        els = retry_policy.call(
+            search_func,
+            endpoint=endpoint,
+            min_round=min_max_round[0],
+            max_round=min_max_round[1],
+            **kwargs
+        )
+
         next_page = els.get('next-token', None)
 
         if next_page is None or (next_page is not None and "EOF"  in next_page):
@@ -37,14 +267,15 @@ def threaded_search(search_func, n_threads, min_round, max_round, **kwargs):
         elements = els[search_key]
 
         while (next_page is not None and "EOF" not in next_page) or next_page is not None:
-            while True:
-                try:
-                    els = search_func(min_round=min_max_round[0], max_round=min_max_round[1], next_page=next_page, **kwargs)
-                    break
-                except (IndexerHTTPError, Exception) as e:
-                    print(e)
-                    sleep(1)
-            
+            els = retry_policy.call(
+                search_func,
+                endpoint=endpoint,
+                min_round=min_max_round[0],
+                max_round=min_max_round[1],
+                next_page=next_page,
+                **kwargs
+            )
+
             next_page = els.get('next-token', None)
             elements.extend(els[search_key])
         
@@ -56,7 +287,7 @@ def threaded_search(search_func, n_threads, min_round, max_round, **kwargs):
 
     return {
         "current-round": max_round,
-        search_key: sum((response[search_key] for response in result), []),
+        search_key: merge_results(response[search_key] for response in result),
     }
 
 def time(func, **kwargs):
@@ -65,7 +296,7 @@ def time(func, **kwargs):
     return res, perf_counter() - start
 
 
-def main():
+def search_benchmark():
     sleep(10)
     indexer_client = IndexerClient("", "https://algoindexer.algoexplorerapi.io")
     current_round = 25051412
@@ -95,6 +326,38 @@ def main():
     print(len(txs["transactions"]))
 
 
+def sum_merge(results):
+    # the merge threaded_search used before merge_results
+    return sum(results, [])
+
+
+def merge_benchmark(n_chunks, chunk_size):
+    results = [[{"id": i} for i in range(chunk_size)] for _ in range(n_chunks)]
+
+    merged_sum, sum_time = time(sum_merge, results=results)
+    merged, merge_time = time(merge_results, results=results)
+    assert merged == merged_sum
+
+    print(
+        "%d chunks of %d: sum %.3fs, chain %.3fs"
+        % (n_chunks, chunk_size, sum_time, merge_time)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Input processor")
+    parser.add_argument(
+        "--benchmark", type=str, default="search", choices=["search", "merge"]
+    )
+    parser.add_argument("--n_chunks", type=int, default=32)
+    parser.add_argument("--chunk_size", type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.benchmark == "merge":
+        merge_benchmark(args.n_chunks, args.chunk_size)
+    else:
+        search_benchmark()
+
 
 if __name__ == "__main__":
     main()